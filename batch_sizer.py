@@ -0,0 +1,53 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# Tunes number of items per refresh mutation from observed latency, payload size and error rate.
+# Batch size grows while requests are fast and successful and shrinks when they are slow or fail.
+class BatchSizer:
+    def __init__(self, max_size=1000, min_size=1, target_latency=10, max_payload=512 * 1024, adaptive=True):
+        self.max_size = max_size
+        self.min_size = min_size
+        self.target_latency = target_latency
+        self.max_payload = max_payload
+        self.adaptive = adaptive
+        self.error_rate = 0.0
+        self._size = max_size
+        self._bytes_per_item = None
+        self._lock = threading.Lock()
+
+    # Number of items for the next batch
+    @property
+    def size(self):
+        with self._lock:
+            size = self._size
+            if self._bytes_per_item:
+                size = min(size, int(self.max_payload / self._bytes_per_item))
+            return max(self.min_size, min(size, self.max_size))
+
+    def _set_size(self, size):
+        size = max(self.min_size, min(int(size), self.max_size))
+        if size != self._size:
+            logger.info(f"Batch size: {self._size} -> {size}")
+        self._size = size
+
+    def record_success(self, item_count, latency, payload_bytes):
+        with self._lock:
+            # Exponentially weighted averages so old observations fade out
+            self.error_rate *= 0.8
+            bytes_per_item = payload_bytes / max(item_count, 1)
+            self._bytes_per_item = bytes_per_item if self._bytes_per_item is None else 0.8 * self._bytes_per_item + 0.2 * bytes_per_item
+            if not self.adaptive or item_count < self._size:
+                return
+            if latency < self.target_latency / 2 and self.error_rate < 0.05:
+                self._set_size(self._size * 1.25 + 1)
+            elif latency > self.target_latency:
+                self._set_size(self._size * self.target_latency / latency)
+
+    def record_failure(self, item_count):
+        with self._lock:
+            self.error_rate = 0.8 * self.error_rate + 0.2
+            if self.adaptive and item_count >= self.min_size:
+                self._set_size(min(self._size, item_count) / 2)
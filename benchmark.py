@@ -0,0 +1,142 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+
+import check
+import manual_mutation
+import update
+from checkpoint import CrawlCheckpoint
+from client import GraphQLClient
+from collection import create_items_list, get_collection_detail
+from item_list import count_update_items, item_list_path, iter_update_items
+from mock_server import MockCollection, MockState, start_mock_server
+from rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+CONTRACT_ADDRESS = "0xbenchmark"
+
+
+# Run benchmark step and measure wall time and requests sent to the mock server.
+# tracemalloc slows allocations several-fold, so peak memory is measured in a second, untimed run.
+def measure(name, state, item_count, step, trace_memory=True):
+    requests_before = state.request_count if state else 0
+    start = time.perf_counter()
+    step()
+    seconds = time.perf_counter() - start
+    requests = (state.request_count if state else 0) - requests_before
+
+    peak = 0
+    if trace_memory:
+        tracemalloc.start()
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    result = {
+        "benchmark": name,
+        "items": item_count,
+        "seconds": round(seconds, 3),
+        "items_per_sec": round(item_count / seconds, 1) if seconds else None,
+        "requests": requests,
+        "requests_per_sec": round(requests / seconds, 1) if seconds else None,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+    logger.info(f"{name}: {result['items_per_sec']} items/s, {result['requests_per_sec']} requests/s, peak {result['peak_memory_mb']} MB")
+    return result
+
+
+def run_benchmarks(args):
+    state = MockState(
+        MockCollection(args.items, null_ratio=args.null_ratio),
+        latency=args.latency,
+        rate_limit_every=args.rate_limit_every,
+        duplicate_page_ratio=args.duplicate_page_ratio,
+    )
+    server, url = start_mock_server(state)
+
+    # Rate limit is set high so the numbers show client and server cost, not the limiter
+    limiter = RateLimiter(delay=1 / args.rate, cool_down=0.05, max_retries=10)
+    client = GraphQLClient(limiter, url=url, pool_size=max(args.concurrency, 1))
+    results = []
+
+    def crawl():
+        (collection_slug, total_count) = get_collection_detail(client, CONTRACT_ADDRESS)
+        checkpoint = CrawlCheckpoint(CONTRACT_ADDRESS)
+        create_items_list(client, collection_slug, total_count, 100, checkpoint, args.query)
+        checkpoint.finalize()
+    results.append(measure("create_items_list", state, args.items, crawl, args.memory))
+    item_count = count_update_items(CONTRACT_ADDRESS)
+
+    def refresh():
+        update.queue_metadata_update(client, iter_update_items(CONTRACT_ADDRESS), args.batch_size, args.concurrency, item_count, retries=0)
+    results.append(measure("queue_metadata_update", state, item_count, refresh, args.memory))
+
+    def mutation_files():
+        manual_mutation.create_mutation(CONTRACT_ADDRESS, iter_update_items(CONTRACT_ADDRESS), args.batch_size)
+    results.append(measure("manual_mutation.create_mutation", None, item_count, mutation_files, args.memory))
+
+    def analysis():
+        check.analyze_items(iter_update_items(CONTRACT_ADDRESS), "QmNewHash")
+    results.append(measure("check.analyze_items", None, item_count, analysis, args.memory))
+
+    def scan():
+        check.scan_item_list(item_list_path(CONTRACT_ADDRESS), "QmNewHash")
+    results.append(measure("check.scan_item_list", None, item_count, scan, args.memory))
+
+    client.close()
+    server.shutdown()
+    return results
+
+
+# Parse args
+def get_script_arguments():
+    parser = argparse.ArgumentParser(description='Measure crawl, refresh and analysis throughput against the local mock server. Usage example: python benchmark.py --items 50000 --latency 0.05 -j 4')
+    parser.add_argument('--items',type=int,default=10000,help='(optional) Number of items in the synthetic collection. Default is 10000.')
+    parser.add_argument('--latency',type=float,default=0.02,help='(optional) Seconds added to every mock server response. Default is 0.02.')
+    parser.add_argument('--rate-limit-every',type=int,default=0,help='(optional) Mock server answers with 429 every N requests. Default is 0 (never).')
+    parser.add_argument('--null-ratio',type=float,default=0.0,help='(optional) Share of items returned as null asset. Default is 0.')
+    parser.add_argument('--duplicate-page-ratio',type=float,default=0.0,help='(optional) Share of pages served again instead of the next page. Default is 0.')
+    parser.add_argument('--rate',type=float,default=1000,help='(optional) Initial API calls per second of the client. Default is 1000.')
+    parser.add_argument('--query',choices=['update','check'],default='check',help='(optional) Crawl query. Default is check.')
+    parser.add_argument('-b','--batch_size',type=int,default=1000,help='(optional) Queues per mutation request. Default is 1000.')
+    parser.add_argument('-j','--concurrency',type=int,default=1,help='(optional) Mutation batches in flight at once. Default is 1.')
+    parser.add_argument('--no-memory',dest='memory',action='store_false',help='(optional) Skip peak memory measurement (saves one extra run of every benchmark).')
+    parser.add_argument('-o','--output',type=str,help='(optional) Save results to this json file.')
+    args = parser.parse_args()
+    logger.info(args)
+    return args
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Benchmark] - %(levelname)s - %(message)s', level=logging.INFO)
+    args = get_script_arguments()
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Item lists and mutation files are written to a temporary directory
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.makedirs("update_lists")
+        # Only show benchmark results, not per-page progress
+        logging.getLogger().setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+        try:
+            results = run_benchmarks(args)
+        finally:
+            os.chdir(cwd)
+
+    print(f"{'benchmark':<34}{'items':>8}{'seconds':>10}{'items/s':>12}{'requests':>10}{'requests/s':>12}{'peak MB':>10}")
+    for result in results:
+        print(f"{result['benchmark']:<34}{result['items']:>8}{result['seconds']:>10}{result['items_per_sec']:>12}{result['requests']:>10}{result['requests_per_sec']:>12}{result['peak_memory_mb']:>10}")
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
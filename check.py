@@ -2,11 +2,26 @@ import argparse
 import json
 import logging
 import itertools
-import requests
-import time
+import math
+import mmap
+import os
+import re
+from collections import Counter
+from statistics import NormalDist
+from checkpoint import CrawlCheckpoint
+from client import add_client_arguments, create_client
+from collection import get_collection_detail, create_items_list, create_items_list_bidirectional, crawl_concurrency, sample_items
+from item_list import iter_update_items, item_list_path
+from metrics import start_metrics, finish_metrics
 
 logger = logging.getLogger(__name__)
 
+# Fields of item list lines as written by item_list.dump_item
+TOKEN_ID_PATTERN = re.compile(rb'"tokenId": "([^"]*)"')
+METADATA_PATTERN = re.compile(rb'"tokenId": "\d+", "tokenMetadata": "')
+# Characters of a json string up to the shortest match: escaped quotes (e.g. json in a data: URI) don't end the string
+JSON_STRING_CHARS = rb'(?:[^"\\]|\\.)*?'
+
 # Process items in chunks
 def chunks(iterable, size):
     it = iter(iterable)
@@ -16,222 +31,275 @@ def chunks(iterable, size):
             break
         yield chunk
 
-# Save update list to file
-def save_update_items(contract_address, items):
-    with open(f'update_lists/{contract_address}_item_list.json', 'w') as file:
-        json.dump(items, file)
-
-
-# Load update list from file
-def load_update_items(contract_address):
-    with open(f'update_lists/{contract_address}_item_list.json', 'r') as file:
-        items = json.load(file)
-    return sorted(items,key=lambda x: x["node"]["asset"]["tokenId"])
-
-# load query from file
-def load_gql_query(file_name):
-    with open(f'query/{file_name}', 'r') as file:
-        query = file.read()
-    return query
-
-
 # Parse args
 def get_script_arguments():
     parser = argparse.ArgumentParser(description='Usage example: python check.py -c "0x6c94954d0b265f657a4a1b35dfaa8b73d1a3f199" -s "QmT5uADipP1xmWSXXx9r7Bnzrb5gwNnuLdH8ohP3ue3qw9"')
     parser.add_argument('-u', '--uri-check-only',action='store_true',help='Use this to check new URI counts from saved file. Requires: "-s"("--hash")')
+    parser.add_argument('--resume',action='store_true',help='(optional) Continue interrupted crawl from the last saved page.')
+    parser.add_argument('--bidirectional',action='store_true',help="(optional) Query items from both ends of the collection at once. Can't be used with '--resume'.")
     parser.add_argument('-c','--contract-address',required=True,type=str,help='Contract address of NFT collection.')
     parser.add_argument('-s','--hash',type=str,help="(optional) Use this to count metadata with new URI.")
     parser.add_argument('-n','--null-ids',action='store_true',help='(optional) Use this to show token id of missing items.')
-    parser.add_argument('--cool-down',type=int,default=1,help='(optional) Seconds to wait when API rate limit is reached. Default is 1.')
-    parser.add_argument('--delay',type=int,default=0.2,help='(optional) Interval of each API call. Default is 0.2.')
+    parser.add_argument('--stale-ids',action='store_true',help='(optional) Use this to show token id of items without new hash.')
+    parser.add_argument('-r','--report',type=str,help='(optional) Save missing, duplicated and stale-hash token ids to this json file.')
+    parser.add_argument('--sample',type=int,help='(optional) Estimate share of items with new hash from this many randomly placed pages (one per equal part of the collection) instead of querying every item. Requires: "-s"("--hash")')
+    parser.add_argument('--sample-page-size',type=int,default=20,help="(optional) Items per sampled page on '--sample'. Default is 20.")
+    parser.add_argument('--confidence',type=float,default=0.95,help="(optional) Confidence level of the estimate on '--sample'. Default is 0.95.")
+    parser.add_argument('--escalate-at',type=float,help="(optional) Query every item when the '--sample' estimate reaches this share, e.g. 0.99.")
+    parser.add_argument('--seed',type=int,help="(optional) Random seed of '--sample' page offsets.")
+    add_client_arguments(parser)
     args = parser.parse_args()
+    if args.bidirectional and args.resume:
+        parser.error("--bidirectional can't be used with --resume")
+    if args.sample and not args.hash:
+        parser.error("--sample requires -s/--hash")
+    if args.sample and args.uri_check_only:
+        parser.error("--sample can't be used with -u")
     logger.info(args)
     return args
 
-# Query collectionSlug and total number of items from Contract address
-def get_collection_detail(contract_address, cool_down):
-    url = "https://api.opensea.io/graphql/"
-    # bypass cloudflare
-    header={
-        "Content-Type": "application/json",
-        "User-Agent": "PostmanRuntime/7.26.8"
-    }
-    # Graphql Query: Get collectionSlug
-    slug_query = load_gql_query("slug_query.graphql")
-    slug_variables = {
-        "query": f"{contract_address}"
-    }
-    slug_param = {'query': slug_query, 'variables': slug_variables}
-    # Make http POST
-    slug_response = requests.post(url, json=slug_param, headers=header)
-    if slug_response.status_code != 200:
-        logger.warning(slug_response.text)
-        logger.warning("Terminating Process: Check contract address")
-        return ((),)
-    
-    try:
-        slug_data = slug_response.json()
-        slug_result = slug_data["data"]["collections"]["edges"][0]
-        collection_slug = slug_result["node"]["slug"]
-    except:
-        logger.warning("Terminating Process: No CollectionSlug Found")
-        return((),)
-    
-    logger.info(f"Found Collection: {collection_slug}")
-    
-    # wait for rate limit cooldown
-    time.sleep(cool_down)
-
-    # Graphql Query: Get number of items in collection
-    count_query = load_gql_query("collection_item_count_query.graphql")
-    count_variables = {
-        "collections": [f"{collection_slug}"]
-    }
-    count_param = {'query': count_query, 'variables': count_variables}
-    # Make http POST
-    count_response = requests.post(url, json=count_param, headers=header)
-    if count_response.status_code != 200:
-        logger.warning(count_response.text)
-        logger.warning("Terminating Process: POST Request Error")
-        return ((),)
-
-    try:
-        count_data = count_response.json()
-        count_result = count_data["data"]["search"]["totalCount"]
-    except:
-        logger.warning("Terminating Process: No totalCount Found")
-        return((),)
-    
-    logger.info(f"Total items in Collection: {count_result}")
-    
-    return (collection_slug, count_result)
-
-# This will create update list of collection which includes data needed to queue metadata update
-def create_items_list(collection_slug, total_count, limit, cool_down, delay):
-    complete_items = []
-    total_null_count = 0
-    url = "https://api.opensea.io/graphql/"
-    next_curser = ""
-    has_next_page = True
-
-    # bypass cloudflare
-    header={
-        "Content-Type": "application/json",
-        "User-Agent": "PostmanRuntime/7.26.8"
-    }
+# Format ranges as "1-3,7"
+def format_ranges(ranges):
+    return ",".join(str(start) if start == end else f"{start}-{end}" for start, end in ranges)
 
-    query = load_gql_query("asset_search_list_pagination_query.graphql")
-
-    while has_next_page:
-        time.sleep(delay)
-
-        variables = {
-        "collections": [
-            f"{collection_slug}"
-        ],
-        "count": limit,
-        "cursor": f"{next_curser}"
-        }
-        param = {'query': query, 'variables': variables}
-
-        # Flag for http request result
-        success = False
-
-        while not success:
-            # Make http POST
-            response = requests.post(url, json=param, headers=header)
-            # Check for HTTP error
-            if response.status_code != 200:
-                logger.warning(response.text)
-
-                # Rate Limit Cooldown Counter
-                for _ in range(cool_down, 0, -1):
-                    time.sleep(1)
-            
-            # Request Success: Escape HTTP request loop
-            else:
-                success = True
-            
+# Analyze items in one pass: missing token id ranges, duplicated token ids and items without new hash.
+# Gaps are found between neighbours of the sorted unique ids, so sparse uint256 token ids stay cheap.
+def analyze_items(items, new_hash=None):
+    id_counts = {}
+    stale_token_ids = []
+    item_count = 0
+    new_hash_count = 0
+    missing_metadata_count = 0
+    parse_fail_count = 0
+    for item in items:
+        item_count += 1
         try:
-            data = response.json()
-            search_result = data["data"]["search"]
-            items = search_result["edges"]
-            # Remove null assets
-            filtered_items = list(filter(lambda x: x["node"]["asset"] != None, items))
-            # Log number of null assets
-            if len(filtered_items) < len(items):
-                null_count = len(items)-len(filtered_items)
-                total_null_count += null_count
-                logger.warning(f"Found {null_count} null Asset.")
-
-            complete_items.extend(filtered_items)
-            # Check if next page is available
-            has_next_page = search_result["pageInfo"]["hasNextPage"]
-            if has_next_page:
-                next_curser = search_result["pageInfo"]["endCursor"]
-        
+            token_id = int(item.token_id)
         except:
-            logger.warning(f"{response.text}")
-            logger.warning("Error Ignored")
-            has_next_page = False
+            logger.warning("Parsing Item Failed: Skipped")
+            parse_fail_count += 1
+            continue
+        id_counts[token_id] = id_counts.get(token_id, 0) + 1
+        # Check if metadata uri matches given uri
+        if new_hash:
+            if item.token_metadata is None:
+                missing_metadata_count += 1
+            elif new_hash in item.token_metadata:
+                new_hash_count += 1
+            else:
+                stale_token_ids.append(token_id)
 
-        logger.info(f"{len(complete_items)}/{total_count} items completed")
-    
-    logger.info(f"{total_null_count} items returned 'null'")
+    return _build_report(id_counts, item_count, parse_fail_count, new_hash, new_hash_count, missing_metadata_count, stale_token_ids)
 
-    return complete_items
+# Report of analyze_items and scan_item_list. id_counts maps int token id to number of items with it
+def _build_report(id_counts, item_count, parse_fail_count, new_hash, new_hash_count, missing_metadata_count, stale_token_ids):
+    unique_ids = sorted(id_counts)
+    missing_ranges = [(prev + 1, next - 1) for prev, next in zip(unique_ids, unique_ids[1:]) if next - prev > 1]
+    duplicate_token_ids = [id for id in unique_ids if id_counts[id] > 1]
+    stale_token_ids.sort()
 
-def find_null_token_ids_and_new_hash(items, new_hash, show_null_ids):
-    token_ids = []
-    new_hash_count = 0
-    for item in items:
-        try:
-            token_id = item["node"]["asset"]["tokenId"]
-            token_ids.append(int(token_id))
-            # Check if metadata uri matches given uri
+    return {
+        "item_count": item_count,
+        "unique_count": len(unique_ids),
+        "parse_fail_count": parse_fail_count,
+        "min_token_id": str(unique_ids[0]) if unique_ids else None,
+        "max_token_id": str(unique_ids[-1]) if unique_ids else None,
+        "missing_count": sum(end - start + 1 for start, end in missing_ranges),
+        "missing": [[str(start), str(end)] for start, end in missing_ranges],
+        "duplicated": [str(id) for id in duplicate_token_ids],
+        "new_hash": new_hash,
+        "new_hash_count": new_hash_count,
+        "missing_metadata_count": missing_metadata_count,
+        "stale": [str(id) for id in stale_token_ids],
+    }
+
+# Wilson score interval of proportion successes/n. n may be fractional (effective sample size)
+def wilson_interval(successes, n, confidence=0.95):
+    if n <= 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+# Estimate share of items with new hash from sampled pages.
+# Neighbouring tokens tend to be revealed together, so items of one page are not independent:
+# sample size is divided by the design effect measured from the spread between pages before computing the interval.
+def estimate_updated_share(pages, new_hash, confidence=0.95):
+    counts = [(sum(1 for item in page if item.token_metadata and new_hash in item.token_metadata), len(page)) for page in pages if page]
+    item_count = sum(size for _, size in counts)
+    if not item_count:
+        return None
+    updated_count = sum(updated for updated, _ in counts)
+    share = updated_count / item_count
+    design_effect = 1.0
+    if len(counts) > 1 and 0 < share < 1:
+        mean_size = item_count / len(counts)
+        page_variance = sum((updated - share * size) ** 2 for updated, size in counts) / (len(counts) * (len(counts) - 1) * mean_size ** 2)
+        design_effect = max(1.0, page_variance / (share * (1 - share) / item_count))
+    effective_count = item_count / design_effect
+    low, high = wilson_interval(share * effective_count, effective_count, confidence)
+    return {
+        "sampled_pages": len(counts),
+        "sampled_items": item_count,
+        "updated_items": updated_count,
+        "estimate": share,
+        "low": low,
+        "high": high,
+        "confidence": confidence,
+        "design_effect": round(design_effect, 3),
+    }
+
+# Scan item list written by dump_item as raw bytes: regular expressions run over the memory mapped file,
+# so no line is parsed as json and no Item is created. Gives the same report as analyze_items.
+# Stale token ids are only collected with_stale. Returns None if the file is not in dump_item format.
+def scan_item_list(path, new_hash=None, with_stale=True):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return analyze_items([], new_hash)
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:12] != b'{"relayId": ':
+                return None
+            token_ids = Counter(TOKEN_ID_PATTERN.findall(data))
+            metadata_count = len(METADATA_PATTERN.findall(data)) if new_hash else 0
+            new_hash_count = 0
+            stale_token_ids = []
             if new_hash:
-                if new_hash in item["node"]["asset"]["tokenMetadata"]:
-                        new_hash_count += 1
-        except:
-            logger.warning("Parsing Item Failed: Skipped")
-    token_ids.sort()
-    null_token_ids = []
-    for id in range(token_ids[0], token_ids[-1]+1):
-        if id not in token_ids:
-            null_token_ids.append(str(id))
-    # look for duplicate entries
-    duplicate_token_ids = list([id for id in token_ids if token_ids.count(id) > 1])
-    
+                hash_bytes = re.escape(new_hash.encode())
+                if with_stale:
+                    # Items with metadata URI are either stale or have the new hash
+                    stale_pattern = rb'"tokenId": "(\d+)", "tokenMetadata": "(?!' + JSON_STRING_CHARS + hash_bytes + rb')'
+                    stale_token_ids = [int(id) for id in re.findall(stale_pattern, data)]
+                    new_hash_count = metadata_count - len(stale_token_ids)
+                else:
+                    new_hash_count = len(re.findall(rb'"tokenId": "\d+", "tokenMetadata": "' + JSON_STRING_CHARS + hash_bytes, data))
+
+    item_count = sum(token_ids.values())
+    id_counts = {int(id): count for id, count in token_ids.items() if id.isdigit()}
+    parse_fail_count = item_count - sum(id_counts.values())
+    if parse_fail_count:
+        logger.warning(f"Parsing {parse_fail_count} Items Failed: Skipped")
+    # Like analyze_items, items with unparsable token id are not checked for metadata
+    missing_metadata_count = item_count - parse_fail_count - metadata_count if new_hash else 0
+    return _build_report(id_counts, item_count, parse_fail_count, new_hash, new_hash_count, missing_metadata_count, stale_token_ids)
+
+# Save analysis report as json
+def save_report(report, path):
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Saved report to {path}")
+
+# Group sorted ids into (start, end) ranges of consecutive ids
+def to_ranges(ids):
+    ranges = []
+    for id in ids:
+        if ranges and id == ranges[-1][1] + 1:
+            ranges[-1][1] = id
+        else:
+            ranges.append([id, id])
+    return ranges
+
+def log_report(report, show_null_ids, report_path=None, show_stale_ids=False):
+    item_count = report["item_count"]
+    new_hash = report["new_hash"]
+    duplicate_token_ids = report["duplicated"]
+
     logger.info(f'Found {len(duplicate_token_ids)} duplicate IDs: {duplicate_token_ids}')
 
+    if report["missing_metadata_count"]:
+        logger.warning(f'{report["missing_metadata_count"]} items have no metadata URI saved: Create list with "python update.py --create-list --query check" or run check.py without "-u"')
+
     if new_hash:
-        logger.info(f"{new_hash_count}/{len(items)} items has new hash ({new_hash_count/len(items)*100}%)")
+        new_hash_count = report["new_hash_count"]
+        if item_count:
+            logger.info(f"{new_hash_count}/{item_count} items has new hash ({new_hash_count/item_count*100}%)")
+        else:
+            logger.warning("No items in saved item list")
+        if show_stale_ids:
+            logger.info(f'Stale Item Ids ({len(report["stale"])}):{format_ranges(to_ranges(int(id) for id in report["stale"]))}')
     else:
         logger.info('Set "-s" flag with new hash to check new hash count.')
 
     if show_null_ids:
-        logger.info(f'Null Item Ids:{",".join(null_token_ids)}')
+        missing_ranges = [(int(start), int(end)) for start, end in report["missing"]]
+        logger.info(f'Null Item Ids ({report["missing_count"]}):{format_ranges(missing_ranges)}')
     else:
         logger.info('Set "-n" flag to show token id of null items')
 
+    if report_path:
+        save_report(report, report_path)
+
+
+# Analyze saved item list. Scans the file bytes when possible instead of parsing every line
+def check_saved_items(args):
+    path = item_list_path(args.contract_address)
+    report = None
+    if os.path.exists(path):
+        report = scan_item_list(path, args.hash, with_stale=bool(args.report or args.stale_ids))
+    if report is None:
+        report = analyze_items(iter_update_items(args.contract_address), args.hash)
+    log_report(report, args.null_ids, args.report, args.stale_ids)
+    return report
+
+# Query every item, save item list and analyze it
+def crawl_and_check(client, args, collection_slug, total_count):
+    checkpoint = CrawlCheckpoint(args.contract_address, args.resume)
+    crawl = create_items_list_bidirectional if args.bidirectional else create_items_list
+    crawl(client, collection_slug, total_count, 100, checkpoint, "check", args.contract_address) #limit locked to 100. 100 max.
+    if not checkpoint.finished:
+        if not args.bidirectional:
+            logger.warning("Crawl interrupted: Run again with '--resume' to continue from the last saved page")
+        return
+    checkpoint.finalize()
+    check_saved_items(args)
+    logger.info(f"Successfully Created and Saved {collection_slug}'s Items List")
+
+# Estimate update progress from sampled pages. Returns True if a full crawl should follow
+def sample_and_estimate(client, args, collection_slug, total_count):
+    pages = sample_items(client, collection_slug, total_count, args.sample, args.sample_page_size, "check", args.seed, args.contract_address)
+    estimate = estimate_updated_share(pages, args.hash, args.confidence)
+    if estimate is None:
+        logger.warning("No items sampled")
+        return False
+    logger.info(f'Estimated {estimate["estimate"]*100:.1f}% of items have new hash '
+                f'({estimate["low"]*100:.1f}%-{estimate["high"]*100:.1f}% at {args.confidence*100:g}% confidence, '
+                f'{estimate["updated_items"]}/{estimate["sampled_items"]} sampled items in {estimate["sampled_pages"]} pages)')
+    if args.escalate_at is not None and estimate["estimate"] >= args.escalate_at:
+        logger.info(f"Estimate reached {args.escalate_at*100:g}%: Querying every item")
+        return True
+    if args.report:
+        save_report({"new_hash": args.hash, "total_count": total_count, "sample": estimate}, args.report)
+    return False
+
 
 def main():
     logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Initialize] - %(levelname)s - %(message)s', level=logging.INFO)
     args = get_script_arguments()
+    client = create_client(args, crawl_concurrency(args.bidirectional))
+    start_metrics(args)
+
+    try:
+        if args.uri_check_only:
+            logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Check URI] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
+            check_saved_items(args)
+            return
+
+        collection_detail = get_collection_detail(client, args.contract_address)
+        if len(collection_detail) != 2:
+            return
+        (collection_slug, total_count) = collection_detail
+
+        if args.sample:
+            logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Sample] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
+            if not sample_and_estimate(client, args, collection_slug, total_count):
+                return
 
-    if args.uri_check_only:
-        logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Check URI] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
-        items = load_update_items(args.contract_address)
-        find_null_token_ids_and_new_hash(items, args.hash, args.null_ids)
-    
-    else:
         logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Create List] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
-        (collection_slug, total_count) = get_collection_detail(args.contract_address, args.cool_down)
-        items = create_items_list(collection_slug, total_count, 100, args.cool_down, args.delay) #limit locked to 100. 100 max.
-        save_update_items(args.contract_address,items)
-        find_null_token_ids_and_new_hash(items, args.hash, args.null_ids)
-        logger.info(f"Successfully Created and Saved {collection_slug}'s Items List")
-        
+        crawl_and_check(client, args, collection_slug, total_count)
+    finally:
+        finish_metrics(args)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,162 @@
+import json
+import logging
+import os
+
+from item_list import Item, dump_item, item_list_path, iter_update_items
+from item_store import ItemStore, item_store_path
+
+logger = logging.getLogger(__name__)
+
+
+# Write file atomically: readers see either the old or the new content, never a partial file
+def atomic_write(path, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as file:
+        write(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+# Cursor of the last page of a completed crawl, used to fetch only newly created items next time
+def crawl_state_path(contract_address, directory='update_lists'):
+    return f'{directory}/{contract_address}_crawl_state.json'
+
+
+def load_crawl_state(contract_address, directory='update_lists'):
+    path = crawl_state_path(contract_address, directory)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_crawl_state(contract_address, cursor, item_count, directory='update_lists'):
+    state = {"cursor": cursor, "items": item_count}
+    atomic_write(crawl_state_path(contract_address, directory), lambda file: json.dump(state, file))
+
+
+# On-disk crawl progress. Each page is appended to "{contract}_item_list.part" (one item per line)
+# and the cursor to continue from is saved to "{contract}_checkpoint.json" after the page is on disk.
+# With delta=True the crawl starts after the last page of the saved item list and new items are merged into it.
+class CrawlCheckpoint:
+    def __init__(self, contract_address, resume=False, delta=False, directory='update_lists'):
+        self.contract_address = contract_address
+        self.directory = directory
+        self.items_path = f'{directory}/{contract_address}_item_list.part'
+        self.state_path = f'{directory}/{contract_address}_checkpoint.json'
+        self.final_path = item_list_path(contract_address, directory)
+        self.cursor = ""
+        self.item_count = 0
+        self.null_count = 0
+        self.finished = False
+        self.delta = delta
+        self._offset = 0
+
+        if resume and os.path.exists(self.state_path):
+            self._load()
+        else:
+            self.discard()
+            if delta:
+                self._start_delta()
+
+    def _start_delta(self):
+        crawl_state = load_crawl_state(self.contract_address, self.directory)
+        if not crawl_state or not crawl_state["cursor"] or not os.path.exists(self.final_path):
+            logger.warning("No cursor saved for this item list: Crawling whole collection")
+            self.delta = False
+            return
+        self.cursor = crawl_state["cursor"]
+        logger.info(f"Crawling items created after the {crawl_state['items']} saved items")
+
+    def _load(self):
+        with open(self.state_path, 'r') as file:
+            state = json.load(file)
+        self.cursor = state["cursor"]
+        self.item_count = state["items"]
+        self.null_count = state["null_count"]
+        self.finished = state["finished"]
+        self._offset = state["offset"]
+        self.delta = state.get("delta", False)
+        # Drop page written after the last saved cursor (crash between append and state save)
+        with open(self.items_path, 'a') as file:
+            file.truncate(self._offset)
+        logger.info(f"Resuming crawl from checkpoint: {self.item_count} items saved")
+
+    def _save_state(self):
+        state = {
+            "cursor": self.cursor,
+            "items": self.item_count,
+            "null_count": self.null_count,
+            "finished": self.finished,
+            "offset": self._offset,
+            "delta": self.delta,
+        }
+        atomic_write(self.state_path, lambda file: json.dump(state, file))
+
+    # Append page of items and the end cursor of the page (None keeps the previous cursor)
+    def append_page(self, items, cursor, null_count=0, finished=False):
+        with open(self.items_path, 'a') as file:
+            for item in items:
+                file.write(dump_item(item))
+            file.flush()
+            os.fsync(file.fileno())
+            self._offset = file.tell()
+        if cursor:
+            self.cursor = cursor
+        self.item_count += len(items)
+        self.null_count += null_count
+        self.finished = finished
+        self._save_state()
+
+    def iter_items(self):
+        if not os.path.exists(self.items_path):
+            return
+        with open(self.items_path, 'r') as file:
+            for line in file:
+                yield Item.from_dict(json.loads(line))
+
+    # Atomically replace the item list with the crawled items and remove the checkpoint.
+    # Pages are already in the item list format, so the part file is simply moved into place.
+    # With store, or whenever the collection already has an item store, the item store is updated too so it never
+    # falls behind the item list: new items of a delta crawl are upserted, otherwise it is rebuilt from the item list.
+    def finalize(self, store=False):
+        if not os.path.exists(self.items_path):
+            open(self.items_path, 'w').close()
+        if self.delta:
+            item_count = self._merge()
+        else:
+            item_count = self.item_count
+            os.replace(self.items_path, self.final_path)
+        if store or os.path.exists(item_store_path(self.contract_address, self.directory)):
+            with ItemStore(self.contract_address, self.directory) as item_store:
+                if self.delta and item_store.count():
+                    item_store.upsert(self.iter_items())
+                else:
+                    item_store.replace(iter_update_items(self.contract_address, self.directory))
+        save_crawl_state(self.contract_address, self.cursor, item_count, self.directory)
+        self.discard()
+        return self.final_path
+
+    # Append crawled items that are not in the saved item list yet (by relayId)
+    def _merge(self):
+        seen = set()
+        added = 0
+        def write(file):
+            nonlocal added
+            for item in iter_update_items(self.contract_address, self.directory):
+                seen.add(item.relay_id)
+                file.write(dump_item(item))
+            for item in self.iter_items():
+                if item.relay_id not in seen:
+                    seen.add(item.relay_id)
+                    file.write(dump_item(item))
+                    added += 1
+        atomic_write(self.final_path, write)
+        logger.info(f"Added {added} new items to item list")
+        return len(seen)
+
+    def discard(self):
+        for path in (self.items_path, self.state_path):
+            if os.path.exists(path):
+                os.remove(path)
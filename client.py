@@ -0,0 +1,171 @@
+import gzip
+import json
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import add_metrics_arguments, metrics, operation_name
+from queries import query_hash
+from rate_limiter import RateLimiter, RateLimitExceeded, classify_response
+from response_cache import add_cache_arguments, create_cache
+
+logger = logging.getLogger(__name__)
+
+API_URL = "https://api.opensea.io/graphql/"
+
+# Metrics status label of each response kind
+STATUS_LABELS = {"rate_limit": "429", "server_error": "5xx", "cloudflare": "cloudflare", "client_error": "client_error"}
+
+# bypass cloudflare
+DEFAULT_HEADERS = {
+    "Content-Type": "application/json",
+    "User-Agent": "PostmanRuntime/7.26.8",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+
+# Create httpx client for HTTP/2. Returns None if httpx (with h2) is not installed
+def _create_http2_session(pool_size, timeout):
+    try:
+        import httpx
+        limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        return httpx.Client(http2=True, limits=limits, timeout=httpx.Timeout(timeout[1], connect=timeout[0]), headers=DEFAULT_HEADERS)
+    except ImportError:
+        logger.warning('HTTP/2 requires "httpx[http2]". Falling back to HTTP/1.1')
+        return None
+
+
+# Create requests session with keep-alive connection pool
+def _create_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    return session
+
+
+# GraphQL client shared by every script. All requests go through one connection pool and one rate limiter.
+# With cache (a ResponseCache), fresh cached responses of read queries are returned without a request.
+class GraphQLClient:
+    def __init__(self, limiter, url=API_URL, timeout=(5, 30), pool_size=10, http2=False, compress_requests=False, persisted_queries=False, cache=None):
+        self.limiter = limiter
+        self.cache = cache
+        self.url = url
+        self.timeout = timeout
+        self.compress_requests = compress_requests
+        self.persisted_queries = persisted_queries
+        self.session = _create_http2_session(pool_size, timeout) if http2 else None
+        self.http2 = self.session is not None
+        if not self.session:
+            self.session = _create_session(pool_size)
+
+    def _send(self, param):
+        body = json.dumps(param, separators=(",", ":")).encode()
+        headers = {}
+        if self.compress_requests:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+        if self.http2:
+            return self.session.post(self.url, content=body, headers=headers)
+        return self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+
+    # POST GraphQL request, retrying failed requests up to limiter.max_retries times.
+    # With persisted_queries, requests with variables (the same document sent over and over) only send the query hash.
+    def post(self, param):
+        operation = operation_name(param.get("query"))
+        if self.cache:
+            response = self.cache.get(self.url, operation, param)
+            if response is not None:
+                return response
+        if self.persisted_queries and param.get("variables") is not None:
+            response = self._post_persisted(param)
+        else:
+            response = self._post(param, operation)
+        if self.cache:
+            self.cache.put(self.url, operation, param, response)
+        return response
+
+    # Automatic persisted query: send sha256 of the query instead of its text.
+    # If the server doesn't know the hash yet, the full text is sent once along with the hash to register it.
+    def _post_persisted(self, param):
+        query = param["query"]
+        operation = operation_name(query)
+        extensions = {"persistedQuery": {"version": 1, "sha256Hash": query_hash(query)}}
+        response = self._post({"variables": param["variables"], "extensions": extensions}, operation)
+        if b"PersistedQueryNotSupported" in response.content:
+            logger.warning("Server doesn't support persisted queries: Sending full query text")
+            self.persisted_queries = False
+            return self._post(param, operation)
+        if b"PersistedQueryNotFound" in response.content:
+            metrics.increment("persisted_query_misses")
+            return self._post({**param, "extensions": extensions}, operation)
+        metrics.increment("persisted_query_hits")
+        return response
+
+    def _post(self, param, operation):
+        response = None
+        for attempt in range(self.limiter.max_retries + 1):
+            self.limiter.acquire()
+            start = time.monotonic()
+            try:
+                response = self._send(param)
+            except Exception as e:
+                # requests and httpx connection errors and timeouts
+                metrics.record_request(operation, "connection_error", time.monotonic() - start)
+                logger.warning(f"Request error: {e}")
+                self.limiter.on_error(attempt)
+                continue
+
+            if response.status_code == 200:
+                metrics.record_request(operation, "200", time.monotonic() - start)
+                self.limiter.on_success()
+                return response
+
+            metrics.record_request(operation, STATUS_LABELS[classify_response(response)], time.monotonic() - start)
+
+            logger.warning(f"Response HTML:\n{response.text[:500]}")
+            wait = self.limiter.on_failure(response, attempt)
+            if wait is None:
+                break
+
+        if response is None:
+            raise RateLimitExceeded("Request failed: no response")
+        raise RateLimitExceeded(f"Request failed with HTTP {response.status_code}", response)
+
+    def close(self):
+        self.session.close()
+        if self.cache:
+            self.cache.close()
+
+
+# Add HTTP client and rate limit arguments shared by every script
+def add_client_arguments(parser, cool_down=1, delay=0.2):
+    parser.add_argument('--cool-down',type=float,default=cool_down,help=f'(optional) Base seconds to wait when API rate limit is reached. Doubles on each retry unless the API sends "Retry-After". Default is {cool_down}.')
+    parser.add_argument('--delay',type=float,default=delay,help=f'(optional) Initial interval of each API call. Adjusted automatically while running. Default is {delay}.')
+    parser.add_argument('--max-rate',type=float,help='(optional) Upper limit of API calls per second when ramping up. Default is 4 times the initial rate.')
+    parser.add_argument('--max-retries',type=int,default=5,help='(optional) Number of retries for a failed API call before giving up. Default is 5.')
+    parser.add_argument('--timeout',type=float,default=30,help='(optional) Seconds to wait for an API response. Default is 30.')
+    parser.add_argument('--http2',action='store_true',help='(optional) Use HTTP/2. Requires "httpx[http2]".')
+    parser.add_argument('--compress-requests',action='store_true',help='(optional) Send gzip compressed request bodies.')
+    parser.add_argument('--api-url',type=str,default=API_URL,help=f'(optional) GraphQL endpoint. Default is {API_URL}')
+    parser.add_argument('--persisted-queries',action='store_true',help='(optional) Send only the sha256 hash of repeated queries (automatic persisted queries), with full text fallback when the server does not know the hash.')
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+
+
+# Create rate limiter from parsed script arguments
+def create_limiter(args, concurrency=1):
+    return RateLimiter(args.delay, args.cool_down, args.max_retries, args.max_rate, burst=concurrency)
+
+
+# Create client from parsed script arguments. Pass limiter to share one rate budget between clients
+def create_client(args, concurrency=1, limiter=None):
+    if limiter is None:
+        limiter = create_limiter(args, concurrency)
+    return GraphQLClient(limiter, url=args.api_url, timeout=(min(args.timeout, 10), args.timeout), pool_size=max(concurrency, 1),
+                         http2=args.http2, compress_requests=args.compress_requests, persisted_queries=args.persisted_queries,
+                         cache=create_cache(args))
@@ -0,0 +1,357 @@
+import base64
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from item_list import Item
+from metrics import metrics
+from queries import load_gql_query
+from rate_limiter import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+# Crawl query per mode. "update" only fetches what a refresh mutation needs, "check" adds tokenMetadata
+CRAWL_QUERIES = {
+    "update": "asset_search_list_update_query.graphql",
+    "check": "asset_search_list_check_query.graphql",
+}
+
+# Pages of only seen items in a row before the crawl gives up
+MAX_OVERLAPPING_PAGES = 3
+
+# Cursor chains of a bidirectional crawl, each with its own request in flight
+BIDIRECTIONAL_CHAINS = 2
+
+
+# Query collectionSlug and total number of items from Contract address
+def get_collection_detail(client, contract_address):
+    # Graphql Query: Get collectionSlug
+    slug_query = load_gql_query("slug_query.graphql")
+    slug_variables = {
+        "query": f"{contract_address}"
+    }
+    slug_param = {'query': slug_query, 'variables': slug_variables}
+    # Make http POST
+    try:
+        slug_response = client.post(slug_param)
+    except RateLimitExceeded:
+        logger.warning("Terminating Process: Check contract address")
+        return ((),)
+
+    try:
+        slug_data = slug_response.json()
+        slug_result = slug_data["data"]["collections"]["edges"][0]
+        collection_slug = slug_result["node"]["slug"]
+    except:
+        logger.warning("Terminating Process: No CollectionSlug Found")
+        return((),)
+
+    logger.info(f"Found Collection: {collection_slug}")
+
+    # Graphql Query: Get number of items in collection
+    count_query = load_gql_query("collection_item_count_query.graphql")
+    count_variables = {
+        "collections": [f"{collection_slug}"]
+    }
+    count_param = {'query': count_query, 'variables': count_variables}
+    # Make http POST
+    try:
+        count_response = client.post(count_param)
+    except RateLimitExceeded:
+        logger.warning("Terminating Process: POST Request Error")
+        return ((),)
+
+    try:
+        count_data = count_response.json()
+        count_result = count_data["data"]["search"]["totalCount"]
+    except:
+        logger.warning("Terminating Process: No totalCount Found")
+        return((),)
+
+    logger.info(f"Total items in Collection: {count_result}")
+
+    return (collection_slug, count_result)
+
+# This will create update list of collection which includes data needed to queue metadata update
+# Pages are saved to checkpoint (if given) as they arrive so the crawl can be resumed from the last cursor.
+# Items are only kept in memory without checkpoint; with checkpoint they are read back lazily from disk.
+# Items already seen (by relayId) are dropped as pages arrive. A page of only seen items means the cursor drifted back:
+# the crawl continues after the items found so far (see reanchor_cursor), up to MAX_OVERLAPPING_PAGES in a row.
+# Crawl stops early on a repeated page once every item of the collection was found.
+# collection (contract address) labels crawl progress in metrics when several collections are processed at once.
+def create_items_list(client, collection_slug, total_count, limit, checkpoint=None, query_variant="check", collection=None):
+    complete_items = []
+    item_count = 0
+    total_null_count = 0
+    next_curser = ""
+    has_next_page = True
+    seen = set()
+    overlapping_pages = 0
+
+    if checkpoint:
+        item_count = checkpoint.item_count
+        total_null_count = checkpoint.null_count
+        next_curser = checkpoint.cursor
+        has_next_page = not checkpoint.finished
+        if has_next_page:
+            seen.update(item.relay_id for item in checkpoint.iter_items())
+
+    query = load_gql_query(CRAWL_QUERIES[query_variant])
+    metrics.start_phase("crawl", total_count, item_count + total_null_count, collection)
+
+    while has_next_page:
+        variables = {
+        "collections": [
+            f"{collection_slug}"
+        ],
+        "count": limit,
+        "cursor": f"{next_curser}"
+        }
+        param = {'query': query, 'variables': variables}
+
+        # Make http POST
+        try:
+            response = client.post(param)
+        except RateLimitExceeded:
+            logger.warning("Terminating Crawl: Too many failed requests. Saving items collected so far.")
+            break
+
+        try:
+            data = response.json()
+            search_result = data["data"]["search"]
+            items = search_result["edges"]
+            # Remove null assets
+            filtered_items = [Item.from_dict(x) for x in items if x["node"]["asset"] != None]
+            null_count = len(items)-len(filtered_items)
+            # Remove items already seen on earlier pages
+            new_items = []
+            for item in filtered_items:
+                if item.relay_id not in seen:
+                    seen.add(item.relay_id)
+                    new_items.append(item)
+            duplicate_count = len(filtered_items)-len(new_items)
+            if duplicate_count:
+                metrics.increment("duplicate_items", duplicate_count)
+                logger.warning(f"Dropped {duplicate_count} duplicate items.")
+
+            has_next_page = search_result["pageInfo"]["hasNextPage"]
+            end_cursor = search_result["pageInfo"]["endCursor"]
+            drifted = False
+            # Pages that add any new item are followed as usual: repeated items were dropped above.
+            # A page of only seen items means the cursor drifted back
+            if filtered_items and not new_items and has_next_page:
+                metrics.increment("overlapping_pages")
+                overlapping_pages += 1
+                # Null assets of a repeated page were counted before
+                null_count = 0
+                end_cursor = reanchor_cursor(next_curser, end_cursor, item_count + total_null_count)
+                if item_count + total_null_count >= total_count:
+                    logger.warning("Page repeats seen items after all items were found: Stopping")
+                    has_next_page = False
+                elif end_cursor is None or overlapping_pages > MAX_OVERLAPPING_PAGES:
+                    logger.warning("Terminating Crawl: Cursor keeps returning seen items. Saving items collected so far.")
+                    drifted = True
+                else:
+                    logger.warning(f"Page only repeats seen items: Continuing after the {item_count + total_null_count} items found ({overlapping_pages}/{MAX_OVERLAPPING_PAGES})")
+            else:
+                overlapping_pages = 0
+
+            # Log number of null assets
+            if null_count:
+                total_null_count += null_count
+                logger.warning(f"Found {null_count} null Asset.")
+
+            item_count += len(new_items)
+            if not checkpoint:
+                complete_items.extend(new_items)
+            # Check if next page is available
+            if has_next_page and end_cursor:
+                next_curser = end_cursor
+            if checkpoint:
+                # Keep end cursor of the last page too so a later delta crawl can continue after it.
+                # After drift this is the re-anchored cursor, so '--resume' doesn't ask the repeated page again
+                checkpoint.append_page(new_items, end_cursor, null_count, not has_next_page)
+            if drifted:
+                break
+
+        except:
+            metrics.increment("parse_failures")
+            logger.warning(f"{response.text}")
+            logger.warning("Error Ignored")
+            has_next_page = False
+
+        metrics.set_progress("crawl", item_count + total_null_count, collection=collection)
+        logger.info(f"{item_count}/{total_count} items completed")
+
+    logger.info(f"{total_null_count} items returned 'null'")
+
+    if checkpoint:
+        return checkpoint.iter_items()
+    return complete_items
+
+# Crawl collection from both ends at once: one cursor chain sorted ascending and one descending.
+# Chains stop when they meet (a page contains items already seen by the other chain) and are stitched into one list.
+def create_items_list_bidirectional(client, collection_slug, total_count, limit, checkpoint=None, query_variant="check", collection=None):
+    query = load_gql_query(CRAWL_QUERIES[query_variant])
+    lock = threading.Lock()
+    stop = threading.Event()
+    chains = {
+        direction: {"items": [], "seen": set(), "null_count": 0, "complete": False, "failed": False}
+        for direction in (True, False)
+    }
+    # Number of distinct items found by both chains together
+    unique_count = 0
+    metrics.start_phase("crawl", total_count, collection=collection)
+
+    def crawl_chain(ascending):
+        nonlocal unique_count
+        chain = chains[ascending]
+        other = chains[not ascending]
+        direction = "ascending" if ascending else "descending"
+        next_curser = ""
+
+        while not stop.is_set():
+            variables = {
+            "collections": [
+                f"{collection_slug}"
+            ],
+            "count": limit,
+            "cursor": f"{next_curser}",
+            "sortAscending": ascending
+            }
+            param = {'query': query, 'variables': variables}
+
+            # Make http POST
+            try:
+                response = client.post(param)
+            except RateLimitExceeded:
+                logger.warning(f"Terminating {direction} crawl: Too many failed requests.")
+                chain["failed"] = True
+                stop.set()
+                return
+
+            try:
+                search_result = response.json()["data"]["search"]
+                items = search_result["edges"]
+                has_next_page = search_result["pageInfo"]["hasNextPage"]
+                next_curser = search_result["pageInfo"]["endCursor"]
+            except:
+                metrics.increment("parse_failures")
+                logger.warning(f"{response.text}")
+                logger.warning(f"Terminating {direction} crawl: Failed to parse response")
+                chain["failed"] = True
+                stop.set()
+                return
+
+            filtered_items = [Item.from_dict(x) for x in items if x["node"]["asset"] != None]
+            with lock:
+                chain["null_count"] += len(items)-len(filtered_items)
+                met = any(item.relay_id in other["seen"] for item in filtered_items)
+                for item in filtered_items:
+                    if item.relay_id not in chain["seen"]:
+                        chain["seen"].add(item.relay_id)
+                        chain["items"].append(item)
+                        if item.relay_id not in other["seen"]:
+                            unique_count += 1
+                covered = unique_count + chains[True]["null_count"] + chains[False]["null_count"]
+                metrics.set_progress("crawl", covered, collection=collection)
+                logger.info(f"{covered}/{total_count} items completed")
+
+                if met or not has_next_page or covered >= total_count:
+                    chain["complete"] = True
+                    stop.set()
+
+    with ThreadPoolExecutor(max_workers=BIDIRECTIONAL_CHAINS) as executor:
+        list(executor.map(crawl_chain, (True, False)))
+
+    # Stitch: ascending half, then descending half in ascending order without the overlap
+    complete_items = chains[True]["items"]
+    seen = chains[True]["seen"]
+    complete_items.extend(item for item in reversed(chains[False]["items"]) if item.relay_id not in seen)
+    total_null_count = chains[True]["null_count"] + chains[False]["null_count"]
+    finished = any(c["complete"] for c in chains.values()) and not any(c["failed"] for c in chains.values())
+
+    logger.info(f"{total_null_count} items returned 'null'")
+
+    if checkpoint:
+        if not finished:
+            # Chains only keep their items in memory, so there is no single cursor to resume from
+            checkpoint.discard()
+            logger.warning("Bidirectional crawl can't be resumed: Run '--create-list --bidirectional' again")
+            return iter(())
+        # Last cursor of the ascending chain is not the end of the collection, so no cursor is saved for '--delta'
+        checkpoint.append_page(complete_items, None, total_null_count, finished)
+        return checkpoint.iter_items()
+    return complete_items
+
+
+# Requests a crawl keeps in flight at once. Connection pool and rate limiter burst should be at least this large
+def crawl_concurrency(bidirectional=False):
+    return BIDIRECTIONAL_CHAINS if bidirectional else 1
+
+
+# Relay connection cursor pointing just before item at `offset` ("" for the first item)
+def offset_cursor(offset):
+    if offset <= 0:
+        return ""
+    return base64.b64encode(f"arrayconnection:{offset-1}".encode()).decode()
+
+
+# Offset of the item right after cursor ("" is 0). None for cursors that are not "arrayconnection:N"
+def cursor_offset(cursor):
+    if not cursor:
+        return 0
+    try:
+        return int(base64.b64decode(cursor).decode().split(":")[1]) + 1
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+
+# Cursor to continue from after a page of only seen items was returned for `cursor`: the page's end cursor if the
+# offsets shifted forward, otherwise the offset of the first item not found yet (`found` items and nulls so far).
+# For cursors that are not offsets, the end cursor if it differs from `cursor`, else None.
+def reanchor_cursor(cursor, end_cursor, found):
+    end = cursor_offset(end_cursor)
+    if cursor_offset(cursor) is None or end is None:
+        return end_cursor if end_cursor and end_cursor != cursor else None
+    return offset_cursor(max(end, found))
+
+
+# Stratified page sample: collection is split into `strata` equal ranges and one page of `page_size` items
+# is fetched at a random offset inside each. Returns list of pages (lists of items) in collection order.
+# Relies on search cursors being offset based ("arrayconnection:N"), which lets pages be fetched without crawling to them.
+def sample_items(client, collection_slug, total_count, strata, page_size, query_variant="check", seed=None, collection=None):
+    query = load_gql_query(CRAWL_QUERIES[query_variant])
+    randomizer = random.Random(seed)
+    strata = max(1, min(strata, total_count // page_size or 1))
+    stratum_size = total_count / strata
+    pages = []
+    metrics.start_phase("sample", strata, collection=collection)
+
+    for stratum in range(strata):
+        start = int(stratum * stratum_size)
+        end = max(start, int((stratum + 1) * stratum_size) - page_size)
+        offset = randomizer.randint(start, end)
+        variables = {
+            "collections": [f"{collection_slug}"],
+            "count": page_size,
+            "cursor": offset_cursor(offset),
+        }
+        try:
+            response = client.post({'query': query, 'variables': variables})
+        except RateLimitExceeded:
+            logger.warning("Terminating Sample: Too many failed requests.")
+            break
+        try:
+            edges = response.json()["data"]["search"]["edges"]
+        except:
+            metrics.increment("parse_failures")
+            logger.warning(f"{response.text}")
+            logger.warning("Page Ignored")
+            continue
+        pages.append([Item.from_dict(x) for x in edges if x["node"]["asset"] != None])
+        metrics.set_progress("sample", stratum + 1, collection=collection)
+        logger.info(f"Sampled {stratum+1}/{strata} pages")
+
+    return pages
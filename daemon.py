@@ -0,0 +1,233 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import update
+from batch_sizer import BatchSizer
+from client import add_client_arguments, create_client
+from item_list import dead_letter_path, item_list_path, iter_update_items, save_dead_letter_items
+from item_store import ItemStore, item_store_path
+from metrics import metrics, start_metrics, finish_metrics
+from mutation import add_mutation_arguments, create_compiler
+
+logger = logging.getLogger(__name__)
+
+# Contract address is used in file paths under update_lists/, so nothing else is accepted
+CONTRACT_ADDRESS_PATTERN = re.compile(r'0x[0-9a-fA-F]{40}')
+TOKEN_ID_PATTERN = re.compile(r'[0-9]+')
+
+
+# Finds items of token ids in the saved item list of a collection.
+# Uses the SQLite item store if there is one, otherwise the item list is loaded once and reloaded when it changes.
+class TokenResolver:
+    def __init__(self, directory='update_lists'):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._lists = {}
+
+    def _load_list(self, contract_address):
+        path = item_list_path(contract_address, self.directory)
+        modified = os.path.getmtime(path)
+        cached = self._lists.get(contract_address)
+        if cached is None or cached[0] != modified:
+            items = {item.token_id: item for item in iter_update_items(contract_address, self.directory)}
+            logger.info(f"Loaded {len(items)} items of {contract_address}")
+            cached = self._lists[contract_address] = (modified, items)
+        return cached[1]
+
+    # Returns (items found, token ids not in the item list). Token ids are compared as numbers: "007" is token 7
+    def resolve(self, contract_address, token_ids):
+        requested = {}
+        unknown = []
+        for token_id in token_ids:
+            if isinstance(token_id, (str, int)) and not isinstance(token_id, bool) and TOKEN_ID_PATTERN.fullmatch(str(token_id)):
+                requested.setdefault(str(int(token_id)), token_id)
+            else:
+                unknown.append(token_id)
+        if os.path.exists(item_store_path(contract_address, self.directory)):
+            with ItemStore(contract_address, self.directory) as store:
+                items = store.get_tokens(list(requested))
+        else:
+            with self._lock:
+                items_by_token = self._load_list(contract_address)
+            items = [items_by_token[token_id] for token_id in requested if token_id in items_by_token]
+        found = {item.token_id for item in items}
+        unknown.extend(token_id for key, token_id in requested.items() if key not in found)
+        return items, unknown
+
+
+# Pending refresh requests per collection, deduplicated by relayId.
+# A collection is flushed when it has batch_size items, when no request came for `debounce` seconds,
+# or at the latest `max_delay` seconds after its oldest pending request.
+class RefreshQueue:
+    def __init__(self, batch_size=1000, debounce=2, max_delay=10):
+        self.batch_size = batch_size
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._condition = threading.Condition()
+        self._pending = {}
+        self._closed = False
+
+    def add(self, contract_address, items):
+        now = time.monotonic()
+        with self._condition:
+            pending = self._pending.setdefault(contract_address, {"items": {}, "first": now, "last": now})
+            before = len(pending["items"])
+            for item in items:
+                pending["items"][item.relay_id] = item
+            pending["last"] = now
+            self._condition.notify()
+            return len(pending["items"]) - before
+
+    def _due(self, pending, now):
+        return (len(pending["items"]) >= self.batch_size
+                or now - pending["last"] >= self.debounce
+                or now - pending["first"] >= self.max_delay)
+
+    # Block until a collection is due and return (contract address, items). Returns None once closed and empty
+    def take(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                for contract_address, pending in self._pending.items():
+                    if self._closed or self._due(pending, now):
+                        del self._pending[contract_address]
+                        return contract_address, list(pending["items"].values())
+                if self._closed:
+                    return None
+                # Sleep until the earliest deadline of any pending collection
+                deadlines = [min(pending["last"] + self.debounce, pending["first"] + self.max_delay) for pending in self._pending.values()]
+                self._condition.wait(max(min(deadlines) - now, 0.01) if deadlines else None)
+
+    # Stop accepting waits: remaining collections are returned right away
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def status(self):
+        with self._condition:
+            return {contract_address: len(pending["items"]) for contract_address, pending in self._pending.items()}
+
+
+# Sends due collections through update.queue_metadata_update. Failed items go to the dead letter file
+def flush_loop(queue, client, args):
+    sizer = BatchSizer(args.batch_size, target_latency=args.target_latency, adaptive=not args.fixed_batch_size)
+    compiler = create_compiler(args)
+    while True:
+        taken = queue.take()
+        if taken is None:
+            return
+        contract_address, items = taken
+        logger.info(f"Flushing {len(items)} items of {contract_address}")
+        try:
+            failed = update.queue_metadata_update(client, items, sizer, concurrency=args.concurrency, total=len(items), retries=args.item_retries, compiler=compiler, collection=contract_address)
+        except Exception as e:
+            logger.exception(f"Failed to flush {contract_address}: {e}")
+            failed = items
+        metrics.increment("daemon_flushes")
+        metrics.increment("daemon_flushed_items", len(items) - len(failed))
+        if failed or os.path.exists(dead_letter_path(contract_address)):
+            save_dead_letter_items(contract_address, failed, sent={item.relay_id for item in items})
+
+
+class RefreshHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # GET /status: pending items per collection
+    def do_GET(self):
+        if self.path != "/status":
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, {"pending": self.server.queue.status()})
+
+    # POST /refresh {"contract_address": "0x...", "token_ids": ["1", "2"]}
+    def do_POST(self):
+        if self.path != "/refresh":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            contract_address = request["contract_address"]
+            token_ids = request["token_ids"]
+            if not isinstance(token_ids, list):
+                token_ids = [token_ids]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": f"Expected json with contract_address and token_ids: {e}"})
+            return
+        if not isinstance(contract_address, str) or not CONTRACT_ADDRESS_PATTERN.fullmatch(contract_address):
+            self._send_json(400, {"error": "contract_address must be 0x followed by 40 hex digits"})
+            return
+        try:
+            items, unknown = self.server.resolver.resolve(contract_address, token_ids)
+        except FileNotFoundError:
+            self._send_json(404, {"error": f"No item list saved for {contract_address}: Run 'python update.py --create-list' first"})
+            return
+        queued = self.server.queue.add(contract_address, items)
+        metrics.increment("daemon_requested_items", len(token_ids))
+        if unknown:
+            logger.warning(f"Unknown token ids of {contract_address}: {unknown[:20]}")
+        self._send_json(202, {"queued": queued, "already_pending": len(items) - queued, "unknown": unknown})
+
+
+# Parse args
+def get_script_arguments():
+    parser = argparse.ArgumentParser(description='Run a local service that collects refresh requests for single tokens and queues them in batches. Usage example: python daemon.py --port 8765 && curl -d \'{"contract_address": "0x...", "token_ids": ["1", "2"]}\' http://127.0.0.1:8765/refresh')
+    parser.add_argument('--host',type=str,default='127.0.0.1',help='(optional) Address to listen on. Default is 127.0.0.1.')
+    parser.add_argument('--port',type=int,default=8765,help='(optional) Port to listen on. Default is 8765.')
+    parser.add_argument('-b','--batch_size',type=int,default=1000,help='(optional) Pending items of a collection that trigger a flush, and maximum Queues in one request. Default is 1000.')
+    parser.add_argument('--debounce',type=float,default=2,help='(optional) Flush a collection when no request came for it for this many seconds. Default is 2.')
+    parser.add_argument('--max-delay',type=float,default=10,help='(optional) Flush a collection at the latest this many seconds after its oldest pending request. Default is 10.')
+    parser.add_argument('--fixed-batch-size',action='store_true',help="(optional) Always send '--batch_size' Queues in one request.")
+    parser.add_argument('--target-latency',type=float,default=10,help="(optional) Seconds a mutation request should take. Batch size is lowered when requests are slower. Default is 10.")
+    parser.add_argument('-j','--concurrency',type=int,default=1,help="(optional) Number of mutation batches kept in flight at once. Default is 1.")
+    parser.add_argument('--item-retries',type=int,default=3,help="(optional) Number of times failed items are retried before they are saved to the dead letter file. Default is 3.")
+    add_mutation_arguments(parser)
+    add_client_arguments(parser, cool_down=3, delay=1)
+    args = parser.parse_args()
+    logger.info(args)
+    return args
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Refresh Daemon] - %(levelname)s - %(message)s', level=logging.INFO)
+    args = get_script_arguments()
+    client = create_client(args, args.concurrency)
+    start_metrics(args)
+
+    queue = RefreshQueue(args.batch_size, args.debounce, args.max_delay)
+    flusher = threading.Thread(target=flush_loop, args=(queue, client, args), name="flush")
+    flusher.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), RefreshHandler)
+    server.daemon_threads = True
+    server.queue = queue
+    server.resolver = TokenResolver()
+    logger.info(f"Accepting refresh requests at http://{args.host}:{args.port}/refresh")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping: Flushing pending items")
+    server.server_close()
+    queue.close()
+    flusher.join()
+    client.close()
+    finish_metrics(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+import argparse
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+# Compact item record. Keeps only the fields needed to queue and check metadata updates
+class Item:
+    __slots__ = ("relay_id", "token_id", "token_metadata")
+
+    def __init__(self, relay_id, token_id, token_metadata=None):
+        self.relay_id = relay_id
+        self.token_id = token_id
+        self.token_metadata = token_metadata
+
+    # Create from saved line or API search edge ({"node": {"asset": {...}}})
+    @classmethod
+    def from_dict(cls, data):
+        if "node" in data:
+            data = data["node"]["asset"]
+        return cls(data["relayId"], str(data["tokenId"]), data.get("tokenMetadata"))
+
+    def to_dict(self):
+        data = {"relayId": self.relay_id, "tokenId": self.token_id}
+        if self.token_metadata is not None:
+            data["tokenMetadata"] = self.token_metadata
+        return data
+
+    def __eq__(self, other):
+        return isinstance(other, Item) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Item({self.relay_id!r}, {self.token_id!r}, {self.token_metadata!r})"
+
+
+# Serialize item as one line of the item list
+def dump_item(item):
+    return json.dumps(item.to_dict()) + "\n"
+
+
+# Item lists are stored one item per line (JSON Lines) in crawl order, so they can be appended page by page
+# and read back lazily without parsing the whole file.
+def item_list_path(contract_address, directory='update_lists'):
+    return f'{directory}/{contract_address}_item_list.jsonl'
+
+# Item list format used before JSON Lines: one JSON array
+def legacy_item_list_path(contract_address, directory='update_lists'):
+    return f'{directory}/{contract_address}_item_list.json'
+
+
+# Convert legacy "_item_list.json" to "_item_list.jsonl" (sorted by numeric token id)
+def convert_item_list(contract_address, directory='update_lists'):
+    with open(legacy_item_list_path(contract_address, directory), 'r') as file:
+        items = json.load(file)
+    items = sorted((Item.from_dict(item) for item in items if item["node"]["asset"]), key=lambda x: int(x.token_id))
+
+    path = item_list_path(contract_address, directory)
+    with open(f"{path}.tmp", 'w') as file:
+        for item in items:
+            file.write(dump_item(item))
+    os.replace(f"{path}.tmp", path)
+    logger.info(f"Converted {len(items)} items to {path}")
+    return len(items)
+
+
+# Make sure JSON Lines item list exists, converting legacy list if needed
+def _ensure_item_list(contract_address, directory):
+    path = item_list_path(contract_address, directory)
+    if not os.path.exists(path) and os.path.exists(legacy_item_list_path(contract_address, directory)):
+        logger.info("Found item list in old format: Converting")
+        convert_item_list(contract_address, directory)
+    return path
+
+
+# Load update list lazily, one item at a time
+def iter_update_items(contract_address, directory='update_lists'):
+    path = _ensure_item_list(contract_address, directory)
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield Item.from_dict(json.loads(line))
+
+
+# Count items in update list without parsing them
+def count_update_items(contract_address, directory='update_lists'):
+    path = _ensure_item_list(contract_address, directory)
+    count = 0
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            count += block.count(b"\n")
+    return count
+
+
+# Items that still failed to queue after retries. Consumed by "update.py --update_metadata --retry-failed"
+def dead_letter_path(contract_address, directory='update_lists'):
+    return f'{directory}/{contract_address}_dead_letter.jsonl'
+
+
+def iter_dead_letter_items(contract_address, directory='update_lists'):
+    path = dead_letter_path(contract_address, directory)
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield Item.from_dict(json.loads(line))
+
+
+# Save failed items to dead letter file. With merge, items already in the file are kept (deduplicated by relayId)
+# unless their relayId is in sent: items queued again in this run only stay in the file if they failed again.
+def save_dead_letter_items(contract_address, items, merge=True, sent=(), directory='update_lists'):
+    path = dead_letter_path(contract_address, directory)
+    dead_items = {}
+    if merge:
+        for item in iter_dead_letter_items(contract_address, directory):
+            if item.relay_id not in sent:
+                dead_items[item.relay_id] = item
+    for item in items:
+        dead_items[item.relay_id] = item
+
+    if not dead_items:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    with open(f"{path}.tmp", 'w') as file:
+        for item in dead_items.values():
+            file.write(dump_item(item))
+    os.replace(f"{path}.tmp", path)
+    logger.info(f"Saved {len(dead_items)} failed items to {path}")
+
+
+# Parse args
+def get_script_arguments():
+    parser = argparse.ArgumentParser(description='Convert saved "_item_list.json" to the "_item_list.jsonl" format. Usage example: python item_list.py -c "0x6c94954d0b265f657a4a1b35dfaa8b73d1a3f199"')
+    parser.add_argument('-c','--contract-address',required=True,type=str,help='Contract address of NFT collection.')
+    args = parser.parse_args()
+    logger.info(args)
+    return args
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Convert List] - %(levelname)s - %(message)s', level=logging.INFO)
+    args = get_script_arguments()
+    convert_item_list(args.contract_address)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import argparse
+import logging
+import os
+import sqlite3
+
+from item_list import Item, item_list_path, iter_update_items, legacy_item_list_path
+
+logger = logging.getLogger(__name__)
+
+# Token ids are uint256, too large for SQLite INTEGER. Zero-padded to the 78 digits of 2**256 they sort numerically as text
+TOKEN_KEY_DIGITS = 78
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    relay_id TEXT PRIMARY KEY,
+    token_id TEXT NOT NULL,
+    token_key TEXT,
+    token_metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS items_token_key ON items (token_key);
+CREATE INDEX IF NOT EXISTS items_token_metadata ON items (token_metadata);
+"""
+
+UPSERT = """
+INSERT INTO items (relay_id, token_id, token_key, token_metadata) VALUES (?, ?, ?, ?)
+ON CONFLICT (relay_id) DO UPDATE SET
+    token_id = excluded.token_id,
+    token_key = excluded.token_key,
+    token_metadata = COALESCE(excluded.token_metadata, items.token_metadata)
+"""
+
+
+def item_store_path(contract_address, directory='update_lists'):
+    return f'{directory}/{contract_address}_items.sqlite'
+
+
+# Sortable text key of token id. None for token ids that are not numbers
+def token_key(token_id):
+    try:
+        return str(int(token_id)).zfill(TOKEN_KEY_DIGITS)
+    except (TypeError, ValueError):
+        return None
+
+
+# Parse "500-620,900" into [(500, 620), (900, 900)]. Overlapping ranges are merged
+def parse_token_ranges(text):
+    ranges = []
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        start, separator, end = part.partition("-")
+        start = int(start)
+        end = int(end) if separator else start
+        if end < start:
+            raise ValueError(f"Invalid token range: {part}")
+        ranges.append((start, end))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def in_token_ranges(token_id, ranges):
+    try:
+        token_id = int(token_id)
+    except (TypeError, ValueError):
+        return False
+    return any(start <= token_id <= end for start, end in ranges)
+
+
+# Item list of one collection in SQLite, indexed on token id, relay id and metadata URI.
+# Optional companion of the JSON Lines item list for queries that only need a few items.
+class ItemStore:
+    def __init__(self, contract_address, directory='update_lists'):
+        self.path = item_store_path(contract_address, directory)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def _rows(self, items):
+        for item in items:
+            yield item.relay_id, item.token_id, token_key(item.token_id), item.token_metadata
+
+    # Insert new items and update known ones (by relayId). Saved metadata URI is kept if item has none
+    def upsert(self, items):
+        with self.connection:
+            before = self.connection.total_changes
+            self.connection.executemany(UPSERT, self._rows(items))
+            return self.connection.total_changes - before
+
+    # Replace every item, e.g. with the result of a full crawl
+    def replace(self, items):
+        with self.connection:
+            self.connection.execute("DELETE FROM items")
+            self.connection.executemany(UPSERT, self._rows(items))
+        return self.count()
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+
+    # Items with token id in any of the inclusive ranges, ordered by token id
+    def iter_token_ranges(self, ranges):
+        for start, end in ranges:
+            cursor = self.connection.execute(
+                "SELECT relay_id, token_id, token_metadata FROM items WHERE token_key BETWEEN ? AND ? ORDER BY token_key",
+                (token_key(start), token_key(end)))
+            for relay_id, token_id, token_metadata in cursor:
+                yield Item(relay_id, token_id, token_metadata)
+
+    # Items with any of the token ids
+    def get_tokens(self, token_ids):
+        keys = [key for key in map(token_key, token_ids) if key is not None]
+        items = []
+        # Stay below SQLite's limit of 999 parameters per statement
+        for start in range(0, len(keys), 900):
+            chunk = keys[start:start+900]
+            cursor = self.connection.execute(
+                f"SELECT relay_id, token_id, token_metadata FROM items WHERE token_key IN ({','.join('?' * len(chunk))})", chunk)
+            items.extend(Item(relay_id, token_id, token_metadata) for relay_id, token_id, token_metadata in cursor)
+        return items
+
+    def count_token_ranges(self, ranges):
+        return sum(self.connection.execute("SELECT COUNT(*) FROM items WHERE token_key BETWEEN ? AND ?",
+                                           (token_key(start), token_key(end))).fetchone()[0] for start, end in ranges)
+
+
+# Parse args
+def get_script_arguments():
+    parser = argparse.ArgumentParser(description='Build SQLite item store from saved item list. Usage example: python item_store.py -c "0x6c94954d0b265f657a4a1b35dfaa8b73d1a3f199"')
+    parser.add_argument('-c','--contract-address',required=True,type=str,help='Contract address of NFT collection.')
+    args = parser.parse_args()
+    logger.info(args)
+    return args
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Item Store] - %(levelname)s - %(message)s', level=logging.INFO)
+    args = get_script_arguments()
+    if not os.path.exists(item_list_path(args.contract_address)) and not os.path.exists(legacy_item_list_path(args.contract_address)):
+        logger.warning("No item list saved: Run 'python update.py --create-list' first")
+        return
+    with ItemStore(args.contract_address) as store:
+        count = store.replace(iter_update_items(args.contract_address))
+        logger.info(f"Saved {count} items to {store.path}")
+
+
+if __name__ == '__main__':
+    main()
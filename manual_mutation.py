@@ -1,8 +1,10 @@
-import json
 import itertools
+import json
 import logging
 import argparse
 import os
+from item_list import iter_update_items
+from mutation import MutationCompiler, add_mutation_arguments, batch_key, create_compiler
 
 logger = logging.getLogger(__name__)
 
@@ -16,18 +18,35 @@ def chunks(iterable, size):
         yield chunk
 
 
-# Save update list
-def save_manual_mutation(contract_address, index, mutation):
-    path = f"./manual_push_mutation/{contract_address}/"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(f"./{path}/{index}.graphql", 'w') as file:
+def manual_mutation_directory(contract_address):
+    return f"./manual_push_mutation/{contract_address}"
+
+
+# Save update list. Variables of variables form mutation are saved next to it as {index}.json
+def save_manual_mutation(contract_address, index, mutation, variables=None):
+    path = manual_mutation_directory(contract_address)
+    os.makedirs(path, exist_ok=True)
+    with open(f"{path}/{index}.graphql", 'w') as file:
         file.write(mutation)
+    if variables is not None:
+        with open(f"{path}/{index}.json", 'w') as file:
+            json.dump(variables, file)
+    elif os.path.exists(f"{path}/{index}.json"):
+        os.remove(f"{path}/{index}.json")
 
 
-def load_update_items(contract_address):
-    with open(f'update_lists/{contract_address}_item_list.json', 'r') as file:
-        items = json.load(file)
-    return sorted(items,key=lambda x: x["node"]["asset"]["tokenId"])
+# Batch hash of every saved file, so unchanged batches are not written again
+def load_manifest(contract_address):
+    try:
+        with open(f"{manual_mutation_directory(contract_address)}/manifest.json", 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(contract_address, manifest):
+    with open(f"{manual_mutation_directory(contract_address)}/manifest.json", 'w') as file:
+        json.dump(manifest, file, indent=2)
 
 
 # Parse args
@@ -35,36 +54,47 @@ def get_script_arguments():
     parser = argparse.ArgumentParser(description='Usage example: python manual_mutation.py -c "0x6c94954d0b265f657a4a1b35dfaa8b73d1a3f199"')
     parser.add_argument('-c','--contract-address',required=True,type=str,help='Contract address of NFT collection.')
     parser.add_argument('-b','--batch_size',type=int,default=1000,help="(optional) Number of Queues to batch in one request on '--update_metadata'. Default is 1000.")
+    add_mutation_arguments(parser)
     args = parser.parse_args()
     logger.info(args)
     return args
 
 
-def create_mutation(contract_address, items, batch_size):
+# Write one mutation file per batch. Files whose batch didn't change since the last run are kept as they are
+def create_mutation(contract_address, items, batch_size, compiler=None):
+    compiler = compiler or MutationCompiler()
+    old_manifest = load_manifest(contract_address)
+    manifest = {}
     index = 0
+    written = 0
     for item_chunk in chunks(items, batch_size):
         index += 1
-        mutation_string = ""
-        # Create query detail
-        for item in item_chunk:
+        key = f"{compiler.form}:{batch_key(item_chunk)}"
+        manifest[str(index)] = key
+        if old_manifest.get(str(index)) == key and os.path.exists(f"{manual_mutation_directory(contract_address)}/{index}.graphql"):
+            continue
+        mutation = compiler.compile(item_chunk)
+        save_manual_mutation(contract_address, index, mutation.query, mutation.variables)
+        written += 1
+
+    # Remove files of batches that no longer exist
+    for old_index in old_manifest.keys() - manifest.keys():
+        for extension in ("graphql", "json"):
             try:
-                item_id = item["node"]["asset"]["relayId"]
-                alias = "_" + str(item["node"]["asset"]["tokenId"])
-            except:
-                logger.warning(f'Item ID not Found for: {item["node"]["asset"]["name"]})')
-                
-            mutation_string += f'{alias}: assets {{refresh(asset: "{item_id}")}}'
-
-        mutation = f'mutation {{{mutation_string}}}'
-        # uri_query = query + "&variables="
-        save_manual_mutation(contract_address, index, mutation)
+                os.remove(f"{manual_mutation_directory(contract_address)}/{old_index}.{extension}")
+            except FileNotFoundError:
+                pass
+    if index or old_manifest:
+        os.makedirs(manual_mutation_directory(contract_address), exist_ok=True)
+        save_manifest(contract_address, manifest)
+    logger.info(f"Wrote {written}/{index} mutation files ({index-written} unchanged)")
 
 def main():
     logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Manual Mutation Generator] - %(levelname)s - %(message)s', level=logging.INFO)
     args = get_script_arguments()
 
-    items = load_update_items(args.contract_address)
-    create_mutation(args.contract_address, items, args.batch_size)
+    items = iter_update_items(args.contract_address)
+    create_mutation(args.contract_address, items, args.batch_size, create_compiler(args))
     logger.info("Completed")
 
 
@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of request latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+OPERATION_PATTERN = re.compile(r'^\s*(query|mutation)\s*(\w*)')
+
+
+# GraphQL operation name of query text, e.g. "NavSearchQuery". Unnamed operations are "query" or "mutation"
+@lru_cache(maxsize=64)
+def operation_name(query):
+    match = OPERATION_PATTERN.match(query or "")
+    if not match:
+        return "query"
+    return match.group(2) or match.group(1)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 3),
+            "avg": round(self.sum / self.count, 3) if self.count else None,
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+# Progress of one phase ("crawl", "refresh", ...) for items/sec and ETA.
+# Items done before the phase started (resumed crawl) don't count towards items/sec
+class Progress:
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = done
+        self.initial = done
+        self.start = time.monotonic()
+
+    def to_dict(self):
+        elapsed = time.monotonic() - self.start
+        rate = (self.done - self.initial) / elapsed if elapsed > 0 else 0
+        eta = (self.total - self.done) / rate if rate and self.total else None
+        return {
+            "done": self.done,
+            "total": self.total,
+            "items_per_sec": round(rate, 1),
+            "eta_seconds": round(eta, 1) if eta is not None else None,
+        }
+
+
+# Run-wide metrics: request latency per operation, response counters, sleep time and phase progress
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.requests = {}
+            self.latency = {}
+            self.counters = {}
+            self.sleep_seconds = 0.0
+            self.progress = {}
+
+    # Record one HTTP request. status is "200", "429", "5xx", "cloudflare", "client_error" or "connection_error"
+    def record_request(self, operation, status, seconds):
+        with self._lock:
+            key = (operation, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(operation, Histogram()).observe(seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def record_sleep(self, seconds):
+        with self._lock:
+            self.sleep_seconds += seconds
+
+    # Progress is kept per phase and collection, so collections processed at once don't overwrite each other
+    def start_phase(self, phase, total, done=0, collection=None):
+        with self._lock:
+            self.progress[(phase, collection)] = Progress(total, done)
+
+    def set_progress(self, phase, done, total=None, collection=None):
+        with self._lock:
+            progress = self.progress.get((phase, collection))
+            if progress is None:
+                progress = self.progress[(phase, collection)] = Progress(total)
+            progress.done = done
+            if total is not None:
+                progress.total = total
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self.started, 1),
+                "requests": [{"operation": operation, "status": status, "count": count} for (operation, status), count in sorted(self.requests.items())],
+                "latency": {operation: histogram.to_dict() for operation, histogram in self.latency.items()},
+                "counters": dict(self.counters),
+                "sleep_seconds": round(self.sleep_seconds, 3),
+                "progress": [{"phase": phase, "collection": collection, **progress.to_dict()} for (phase, collection), progress in self.progress.items()],
+            }
+
+    # Prometheus text exposition format
+    def prometheus(self):
+        stats = self.snapshot()
+        lines = ["# TYPE opensea_requests_total counter"]
+        for request in stats["requests"]:
+            lines.append(f'opensea_requests_total{{operation="{request["operation"]}",status="{request["status"]}"}} {request["count"]}')
+        lines.append("# TYPE opensea_request_duration_seconds histogram")
+        for operation, histogram in stats["latency"].items():
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'opensea_request_duration_seconds_bucket{{operation="{operation}",le="{bound}"}} {count}')
+            lines.append(f'opensea_request_duration_seconds_bucket{{operation="{operation}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'opensea_request_duration_seconds_sum{{operation="{operation}"}} {histogram["sum"]}')
+            lines.append(f'opensea_request_duration_seconds_count{{operation="{operation}"}} {histogram["count"]}')
+        lines.append("# TYPE opensea_events_total counter")
+        for name, value in stats["counters"].items():
+            lines.append(f'opensea_events_total{{event="{name}"}} {value}')
+        lines.append("# TYPE opensea_sleep_seconds_total counter")
+        lines.append(f"opensea_sleep_seconds_total {stats['sleep_seconds']}")
+        # Progress gauges, each metric as one group with its own TYPE line
+        for metric, field in (("items_done", "done"), ("items_total", "total"), ("items_per_second", "items_per_sec"), ("eta_seconds", "eta_seconds")):
+            lines.append(f"# TYPE opensea_{metric} gauge")
+            for progress in stats["progress"]:
+                if progress[field] is None:
+                    continue
+                labels = f'phase="{progress["phase"]}"'
+                if progress["collection"] is not None:
+                    labels += f',collection="{progress["collection"]}"'
+                lines.append(f'opensea_{metric}{{{labels}}} {progress[field]}')
+        return "\n".join(lines) + "\n"
+
+    def save(self, path):
+        stats = self.snapshot()
+        with open(f"{path}.tmp", 'w') as file:
+            json.dump(stats, file, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def log_summary(self):
+        stats = self.snapshot()
+        total_requests = sum(request["count"] for request in stats["requests"])
+        failed_requests = sum(request["count"] for request in stats["requests"] if request["status"] != "200")
+        logger.info(f"Requests: {total_requests} ({failed_requests} failed), slept {stats['sleep_seconds']}s, {stats['counters']}")
+        for operation, histogram in stats["latency"].items():
+            logger.info(f"{operation}: {histogram['count']} requests, avg {histogram['avg']}s")
+
+
+# Metrics of this process
+metrics = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def do_GET(self):
+        if self.path.startswith("/stats"):
+            body = json.dumps(metrics.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            body = metrics.prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Serve Prometheus metrics on http://127.0.0.1:{port}/metrics (and json on /stats) in background thread
+def start_metrics_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+    return server
+
+
+# Write json stats file every `interval` seconds in background thread
+def start_stats_file(path, interval=10):
+    def write_periodically():
+        while True:
+            time.sleep(interval)
+            try:
+                metrics.save(path)
+            except OSError as e:
+                logger.warning(f"Failed to write stats file: {e}")
+    threading.Thread(target=write_periodically, daemon=True).start()
+
+
+# Add metrics arguments shared by every script
+def add_metrics_arguments(parser):
+    parser.add_argument('--metrics-port',type=int,help='(optional) Serve Prometheus metrics on this port (http://127.0.0.1:PORT/metrics).')
+    parser.add_argument('--stats-file',type=str,help='(optional) Write request, sleep and throughput stats to this json file while running.')
+    parser.add_argument('--stats-interval',type=float,default=10,help='(optional) Seconds between writes of "--stats-file". Default is 10.')
+
+
+# Start exporters selected by script arguments
+def start_metrics(args):
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    if args.stats_file:
+        start_stats_file(args.stats_file, args.stats_interval)
+
+
+# Log summary and write final stats file
+def finish_metrics(args):
+    metrics.log_summary()
+    if args.stats_file:
+        metrics.save(args.stats_file)
@@ -0,0 +1,257 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+REFRESH_PATTERN = re.compile(r'(\w+): assets \{refresh\(asset: "([^"]*)"\)\}')
+# Item count query asks for a single item; matches minified and formatted text
+FIRST_ONE_PATTERN = re.compile(r'first:\s*1\b')
+# Variables form: refresh(asset: $a0) with relay id in variables
+REFRESH_VARIABLE_PATTERN = re.compile(r'(\w+): assets \{refresh\(asset: \$(\w+)\)\}')
+
+
+def encode_cursor(offset):
+    return base64.b64encode(f"arrayconnection:{offset}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    return int(base64.b64decode(cursor).decode().split(":")[1])
+
+
+# Synthetic collection served by the mock server
+class MockCollection:
+    def __init__(self, size=10000, slug="mock-collection", null_ratio=0.0, revealed_ratio=0.5, seed=0):
+        self.size = size
+        self.slug = slug
+        randomizer = random.Random(seed)
+        self.null_ids = {i for i in range(size) if randomizer.random() < null_ratio}
+        self.revealed_ids = {i for i in range(size) if randomizer.random() < revealed_ratio}
+
+    def relay_id(self, index):
+        return base64.b64encode(f"AssetType:{index}".encode()).decode()
+
+    def asset(self, index):
+        if index in self.null_ids:
+            return None
+        metadata_hash = "QmNewHash" if index in self.revealed_ids else "QmOldHash"
+        return {
+            "relayId": self.relay_id(index),
+            "tokenId": str(index),
+            "tokenMetadata": f"ipfs://{metadata_hash}/{index}",
+            "name": f"#{index}",
+        }
+
+
+# Mock server settings and counters shared by request handlers
+class MockState:
+    def __init__(self, collection, latency=0.0, jitter=0.0, rate_limit_every=0, rate_limit_burst=1, retry_after=0, duplicate_page_ratio=0.0, seed=0, cursor_shift=0, shift_at=0, bad_relay_ids=(), persisted_queries_supported=True):
+        self.collection = collection
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_burst = rate_limit_burst
+        self.retry_after = retry_after
+        self.duplicate_page_ratio = duplicate_page_ratio
+        # Offsets move by cursor_shift once a page at or after shift_at is asked, like items added in front mid-crawl.
+        # Cursors issued before the shift then point cursor_shift items back
+        self.cursor_shift = cursor_shift
+        self.shift_at = shift_at
+        self.shifted = False
+        # Refresh mutations naming any of these assets fail as a whole, like an invalid asset id does on the real API
+        self.bad_relay_ids = set(bad_relay_ids)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.rate_limited_count = 0
+        self.refreshed_count = 0
+        # Automatic persisted queries: sha256 -> query text. Without support, requests with a hash are refused
+        self.persisted_queries_supported = persisted_queries_supported
+        self.persisted_queries = {}
+
+    # Returns True if this request should get 429: `rate_limit_burst` requests in a row every `rate_limit_every` requests
+    def next_request(self):
+        with self.lock:
+            self.request_count += 1
+            if self.rate_limit_every and self.request_count % self.rate_limit_every < self.rate_limit_burst:
+                self.rate_limited_count += 1
+                return True
+            return False
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately: without TCP_NODELAY keep-alive requests stall on delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        state = self.server.state
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        if state.latency or state.jitter:
+            time.sleep(state.latency + state.random.uniform(0, state.jitter))
+
+        if state.next_request():
+            self._send_json(429, {"detail": "Request was throttled."}, {"Retry-After": str(state.retry_after)})
+            return
+
+        try:
+            request = json.loads(body)
+            if "persistedQuery" in (request.get("extensions") or {}) and not state.persisted_queries_supported:
+                self._send_json(200, {"errors": [{"message": "PersistedQueryNotSupported", "extensions": {"code": "PERSISTED_QUERY_NOT_SUPPORTED"}}]})
+                return
+            query = self.persisted_query(state, request)
+            if query is None:
+                self._send_json(200, {"errors": [{"message": "PersistedQueryNotFound", "extensions": {"code": "PERSISTED_QUERY_NOT_FOUND"}}]})
+                return
+            data = self.resolve(state, query, request.get("variables") or {})
+        except Exception as e:
+            self._send_json(400, {"errors": [{"message": str(e)}]})
+            return
+        self._send_json(200, {"data": data})
+
+    # Query text of request. Hash-only requests are looked up, hash + text registers the text. None if hash is unknown
+    def persisted_query(self, state, request):
+        query = request.get("query")
+        persisted = (request.get("extensions") or {}).get("persistedQuery")
+        if not persisted:
+            return query or ""
+        sha256 = persisted.get("sha256Hash")
+        if query is None:
+            with state.lock:
+                return state.persisted_queries.get(sha256)
+        if hashlib.sha256(query.encode()).hexdigest() != sha256:
+            raise ValueError("provided sha does not match query")
+        with state.lock:
+            state.persisted_queries[sha256] = query
+        return query
+
+    def resolve(self, state, query, variables):
+        collection = state.collection
+        if query.lstrip().startswith("mutation"):
+            return self.resolve_refresh(state, query, variables)
+        if "collections(" in query:
+            edges = [{"node": {"slug": collection.slug}}] if variables.get("query") else []
+            return {"collections": {"edges": edges}}
+        if FIRST_ONE_PATTERN.search(query):
+            return {"search": {"totalCount": collection.size}}
+        return self.resolve_search(state, variables)
+
+    def resolve_refresh(self, state, query, variables):
+        results = {}
+        relay_ids = []
+        for alias, relay_id in REFRESH_PATTERN.findall(query):
+            relay_ids.append(relay_id)
+            results[alias] = {"refresh": True}
+        for alias, name in REFRESH_VARIABLE_PATTERN.findall(query):
+            if name not in variables:
+                raise ValueError(f"Variable ${name} is not provided")
+            relay_ids.append(variables[name])
+            results[alias] = {"refresh": True}
+        bad_relay_ids = state.bad_relay_ids.intersection(relay_ids)
+        if bad_relay_ids:
+            raise ValueError(f"Invalid asset: {sorted(bad_relay_ids)[0]}")
+        with state.lock:
+            state.refreshed_count += len(results)
+        return results
+
+    def resolve_search(self, state, variables):
+        collection = state.collection
+        count = variables.get("count") or 100
+        offset = decode_cursor(variables["cursor"]) + 1 if variables.get("cursor") else 0
+        shift = 0
+        if state.cursor_shift:
+            with state.lock:
+                state.shifted = state.shifted or offset >= state.shift_at
+                shift = state.cursor_shift if state.shifted else 0
+            offset = max(offset - shift, 0)
+        # Duplicate page: serve the previous page again, like the real API sometimes does
+        if offset and state.random.random() < state.duplicate_page_ratio:
+            offset = max(offset - count, 0)
+        ascending = variables.get("sortAscending", True)
+        indexes = range(offset, min(offset + count, collection.size))
+        if not ascending:
+            indexes = [collection.size - 1 - i for i in indexes]
+        end = offset + len(indexes) - 1
+        return {"search": {
+            "edges": [{"node": {"asset": collection.asset(i)}} for i in indexes],
+            "totalCount": collection.size,
+            "pageInfo": {"endCursor": encode_cursor(end + shift) if len(indexes) else None, "hasNextPage": end + 1 < collection.size},
+        }}
+
+
+# Start mock server in background thread. Returns (server, url)
+def start_mock_server(state, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.state = state
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://{server.server_address[0]}:{server.server_address[1]}/graphql/"
+    return server, url
+
+
+# Parse args
+def get_script_arguments():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Opensea GraphQL API. Usage example: python mock_server.py --items 10000 --latency 0.05 && python update.py --create-list -c "0x0" --api-url "http://127.0.0.1:8080/graphql/"')
+    parser.add_argument('--port',type=int,default=8080,help='(optional) Port to listen on. Default is 8080.')
+    parser.add_argument('--items',type=int,default=10000,help='(optional) Number of items in the synthetic collection. Default is 10000.')
+    parser.add_argument('--latency',type=float,default=0.0,help='(optional) Seconds added to every response. Default is 0.')
+    parser.add_argument('--jitter',type=float,default=0.0,help='(optional) Random extra seconds (0 to jitter) added to every response. Default is 0.')
+    parser.add_argument('--rate-limit-every',type=int,default=0,help='(optional) Answer with 429 every N requests. Default is 0 (never).')
+    parser.add_argument('--rate-limit-burst',type=int,default=1,help='(optional) Number of 429 responses in a row. Default is 1.')
+    parser.add_argument('--retry-after',type=float,default=0,help='(optional) Retry-After seconds sent with 429. Default is 0.')
+    parser.add_argument('--null-ratio',type=float,default=0.0,help='(optional) Share of items returned as null asset. Default is 0.')
+    parser.add_argument('--duplicate-page-ratio',type=float,default=0.0,help='(optional) Share of pages served again instead of the next page. Default is 0.')
+    parser.add_argument('--revealed-ratio',type=float,default=0.5,help='(optional) Share of items whose metadata URI has the new hash "QmNewHash". Default is 0.5.')
+    parser.add_argument('--cursor-shift',type=int,default=0,help="(optional) Number of items cursors drift back by once a page at '--shift-at' is asked. Default is 0.")
+    parser.add_argument('--shift-at',type=int,default=0,help="(optional) Offset at which '--cursor-shift' starts. Default is 0.")
+    args = parser.parse_args()
+    logger.info(args)
+    return args
+
+
+def create_state(args):
+    collection = MockCollection(args.items, null_ratio=args.null_ratio, revealed_ratio=args.revealed_ratio)
+    return MockState(collection, args.latency, args.jitter, args.rate_limit_every, args.rate_limit_burst, args.retry_after, args.duplicate_page_ratio,
+                     cursor_shift=args.cursor_shift, shift_at=args.shift_at)
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Mock Server] - %(levelname)s - %(message)s', level=logging.INFO)
+    args = get_script_arguments()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), MockHandler)
+    server.state = create_state(args)
+    logger.info(f"Serving {args.items} items at http://127.0.0.1:{args.port}/graphql/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    logger.info(f"Served {server.state.request_count} requests ({server.state.rate_limited_count} rate limited)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import os
+from functools import lru_cache
+
+from checkpoint import atomic_write
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+MUTATION_CACHE_DIRECTORY = "mutation_cache"
+
+# GraphQL type of the "asset" argument of refresh in variables form
+ASSET_ID_TYPE = "AssetRelayID!"
+
+
+# Compiled refresh mutation of one batch. aliases[i] is the response key of item i, None if the item was skipped
+class CompiledMutation:
+    __slots__ = ("query", "variables", "aliases")
+
+    def __init__(self, query, variables, aliases):
+        self.query = query
+        self.variables = variables
+        self.aliases = aliases
+
+    # Bytes of document and variables, used by BatchSizer to cap request size
+    def payload_size(self):
+        return len(self.query) + sum(len(id) for id in (self.variables or {}).values())
+
+    def to_param(self):
+        if self.variables is None:
+            return {'query': self.query}
+        return {'query': self.query, 'variables': self.variables}
+
+
+def _has_ids(item):
+    return item.relay_id is not None and item.token_id is not None
+
+
+# Inline form: relay ids are written into the document, aliased by token id
+def build_inline_document(item_chunk):
+    fields = [f'_{item.token_id}: assets {{refresh(asset: "{item.relay_id}")}}' for item in item_chunk if _has_ids(item)]
+    return f'mutation {{{"".join(fields)}}}'
+
+
+# Variables form: document only depends on the batch size, relay ids are sent as $a0..$aN
+@lru_cache(maxsize=32)
+def build_variables_document(size):
+    definitions = ", ".join(f"$a{index}: {ASSET_ID_TYPE}" for index in range(size))
+    fields = "".join(f'_{index}: assets {{refresh(asset: $a{index})}}' for index in range(size))
+    return f'mutation RefreshAssets({definitions}) {{{fields}}}'
+
+
+# Content address of a batch: sha256 of its item ids, in order
+def batch_key(item_chunk):
+    digest = hashlib.sha256()
+    for item in item_chunk:
+        digest.update(f"{item.relay_id}:{item.token_id}\n".encode())
+    return digest.hexdigest()
+
+
+# Builds refresh mutations for update.py and manual_mutation.py.
+# With cache_directory, inline documents are saved under the hash of their item ids and read back on later runs.
+class MutationCompiler:
+    def __init__(self, form="inline", cache_directory=None):
+        if form not in ("inline", "variables"):
+            raise ValueError(f"Unknown mutation form: {form}")
+        self.form = form
+        self.cache_directory = cache_directory
+
+    def _cache_path(self, key):
+        return f"{self.cache_directory}/{key[:2]}/{key}.graphql"
+
+    def document(self, item_chunk):
+        if not self.cache_directory:
+            return build_inline_document(item_chunk)
+        path = self._cache_path(batch_key(item_chunk))
+        try:
+            with open(path, 'r') as file:
+                metrics.increment("mutation_cache_hits")
+                return file.read()
+        except FileNotFoundError:
+            pass
+        metrics.increment("mutation_cache_misses")
+        document = build_inline_document(item_chunk)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, lambda file: file.write(document))
+        except OSError as e:
+            logger.warning(f"Failed to cache mutation: {e}")
+        return document
+
+    def compile(self, item_chunk):
+        aliases = []
+        variables = {}
+        for item in item_chunk:
+            if not _has_ids(item):
+                logger.warning(f'Item ID not Found for: {item})')
+                aliases.append(None)
+            elif self.form == "variables":
+                index = len(variables)
+                variables[f"a{index}"] = item.relay_id
+                aliases.append(f"_{index}")
+            else:
+                aliases.append(f"_{item.token_id}")
+        if self.form == "variables":
+            return CompiledMutation(build_variables_document(len(variables)), variables, aliases)
+        return CompiledMutation(self.document(item_chunk), None, aliases)
+
+
+# Add mutation arguments shared by update.py and manual_mutation.py
+def add_mutation_arguments(parser):
+    parser.add_argument('--mutation-form',choices=['inline','variables'],default='inline',help='(optional) "inline" writes item IDs into the mutation, "variables" sends a fixed mutation per batch size with item IDs as variables. Default is inline.')
+    parser.add_argument('--mutation-cache',action='store_true',help=f'(optional) Save compiled inline mutations in "{MUTATION_CACHE_DIRECTORY}/" by hash of their item IDs and reuse them on later runs.')
+
+
+# Create compiler from parsed script arguments
+def create_compiler(args):
+    return MutationCompiler(args.mutation_form, MUTATION_CACHE_DIRECTORY if args.mutation_cache else None)
@@ -0,0 +1,84 @@
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import update
+from client import create_client, create_limiter
+from collection import crawl_concurrency
+from metrics import start_metrics, finish_metrics
+from rate_limiter import FairScheduler
+
+logger = logging.getLogger(__name__)
+
+# Load contract addresses from file: one per line, "#" starts a comment
+def load_contract_addresses(file_name):
+    contract_addresses = []
+    with open(file_name, 'r') as file:
+        for line in file:
+            contract_address = line.split("#")[0].strip()
+            if contract_address and contract_address not in contract_addresses:
+                contract_addresses.append(contract_address)
+    return contract_addresses
+
+
+# Parse args. Takes every update.py argument except "-c", plus the address file
+def get_script_arguments():
+    parser = update.create_argument_parser(contract_required=False)
+    parser.description = 'Usage example: python orchestrate.py --create-list --update_metadata -f "contracts.txt"'
+    parser.add_argument('-f','--file',required=True,type=str,help='File with contract addresses of NFT collections, one per line.')
+    parser.add_argument('-p','--parallel',type=int,default=4,help='(optional) Number of collections processed at once. All collections share one API rate budget. Default is 4.')
+    args = parser.parse_args()
+    if args.bidirectional and (args.resume or args.delta):
+        parser.error("--bidirectional can't be used with --resume or --delta")
+    logger.info(args)
+    return args
+
+
+# Run update.py phases for one collection. Errors are logged and returned so other collections keep running
+def process_collection(contract_address, args, scheduler):
+    # Thread name is shown in log lines to tell collections apart
+    threading.current_thread().name = contract_address[:10]
+    collection_args = copy.copy(args)
+    collection_args.contract_address = contract_address
+    client = create_client(collection_args, max(args.concurrency, crawl_concurrency(args.bidirectional)), scheduler.share(contract_address))
+    result = {"contract_address": contract_address, "status": "ok", "items": 0, "failed": 0, "seconds": 0}
+    start = time.monotonic()
+    try:
+        if args.create_list and not update.create_list(client, collection_args):
+            result["status"] = "crawl incomplete"
+        elif args.update_metadata:
+            total, failed = update.update_metadata(client, collection_args)
+            result["items"] = total
+            result["failed"] = len(failed)
+    except Exception as e:
+        logger.exception(f"Failed to process collection: {e}")
+        result["status"] = f"error: {e}"
+    finally:
+        client.close()
+    result["seconds"] = round(time.monotonic() - start, 1)
+    return result
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Orchestrate] - %(threadName)s - %(levelname)s - %(message)s', level=logging.INFO)
+    args = get_script_arguments()
+    contract_addresses = load_contract_addresses(args.file)
+    logger.info(f"Processing {len(contract_addresses)} collections, {args.parallel} at once")
+    start_metrics(args)
+
+    # One rate budget for every collection
+    scheduler = FairScheduler(create_limiter(args, args.parallel * max(args.concurrency, crawl_concurrency(args.bidirectional))))
+    with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+        results = list(executor.map(lambda contract_address: process_collection(contract_address, args, scheduler), contract_addresses))
+
+    for result in results:
+        logger.info(f'{result["contract_address"]}: {result["status"]}, queued {result["items"]-result["failed"]}/{result["items"]} in {result["seconds"]}s')
+    failed_count = sum(1 for result in results if result["status"] != "ok")
+    logger.info(f"Completed {len(results)-failed_count}/{len(results)} collections")
+    finish_metrics(args)
+
+
+if __name__ == '__main__':
+    main()
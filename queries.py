@@ -0,0 +1,126 @@
+import argparse
+import hashlib
+import logging
+import os
+import re
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+QUERY_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query')
+
+# GraphQL lexical tokens. Whitespace, commas and comments are insignificant and dropped by minify_query
+TOKEN_PATTERN = re.compile(r'''
+    (?P<block_string>"""(?:\\"""|[^"]|"(?!""))*""")
+  | (?P<string>"(?:\\.|[^"\\\n])*")
+  | (?P<comment>\#[^\n]*)
+  | (?P<ignored>[\s,\ufeff]+)
+  | (?P<spread>\.\.\.)
+  | (?P<punctuator>[!$&()\:=@\[\]{|}])
+  | (?P<word>-?[_A-Za-z0-9.+-]+)
+''', re.VERBOSE)
+
+OPERATION_PATTERN = re.compile(r'^(query|mutation|subscription|fragment)\b\s*(\w*)|^\{')
+BRACKETS = {"}": "{", ")": "(", "]": "["}
+
+
+# Minify query text: drop comments, commas and whitespace that doesn't separate two words.
+# Raises ValueError on characters GraphQL doesn't allow, unterminated strings and unbalanced brackets.
+def minify_query(text):
+    tokens = []
+    stack = []
+    position = 0
+    while position < len(text):
+        match = TOKEN_PATTERN.match(text, position)
+        if not match:
+            raise ValueError(f"Unexpected character {text[position]!r} at offset {position}")
+        position = match.end()
+        kind = match.lastgroup
+        if kind in ("comment", "ignored"):
+            continue
+        token = match.group()
+        if kind == "punctuator" and token in "{([":
+            stack.append(token)
+        elif kind == "punctuator" and token in BRACKETS:
+            if not stack or stack.pop() != BRACKETS[token]:
+                raise ValueError(f"Unbalanced {token!r} at offset {match.start()}")
+        # Two words (names, numbers, keywords) need a space between them
+        if tokens and kind == "word" and tokens[-1][0] == "word":
+            tokens.append(("ignored", " "))
+        tokens.append((kind, token))
+    if stack:
+        raise ValueError(f"Unclosed {stack[-1]!r}")
+    minified = "".join(token for _, token in tokens)
+    if not OPERATION_PATTERN.match(minified):
+        raise ValueError("Query must start with an operation or fragment definition")
+    return minified
+
+
+# Hex SHA-256 of query text, the persisted query id sent instead of the text
+@lru_cache(maxsize=256)
+def query_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class Query:
+    __slots__ = ("file_name", "text", "sha256", "original_size")
+
+    def __init__(self, file_name, text, original_size):
+        self.file_name = file_name
+        self.text = text
+        self.sha256 = query_hash(text)
+        self.original_size = original_size
+
+
+# Every query in query/, read, validated and minified once
+class QueryRegistry:
+    def __init__(self, directory=QUERY_DIRECTORY):
+        self.queries = {}
+        for file_name in sorted(os.listdir(directory)):
+            if not file_name.endswith(".graphql"):
+                continue
+            with open(os.path.join(directory, file_name), 'r') as file:
+                text = file.read()
+            try:
+                self.queries[file_name] = Query(file_name, minify_query(text), len(text))
+            except ValueError as e:
+                raise ValueError(f"Invalid query {file_name}: {e}") from None
+
+    def get(self, file_name):
+        return self.queries[file_name]
+
+
+# Registry is loaded on first use and shared by the whole process
+@lru_cache(maxsize=None)
+def load_registry(directory=QUERY_DIRECTORY):
+    return QueryRegistry(directory)
+
+
+# Minified text of query file
+def load_gql_query(file_name):
+    return load_registry().get(file_name).text
+
+
+# Parse args
+def get_script_arguments():
+    parser = argparse.ArgumentParser(description='Validate the queries in query/ and show their minified size and persisted query hash. Usage example: python queries.py')
+    parser.add_argument('--show',type=str,help='(optional) Print minified text of this query file.')
+    args = parser.parse_args()
+    logger.info(args)
+    return args
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Queries] - %(levelname)s - %(message)s', level=logging.INFO)
+    args = get_script_arguments()
+    registry = load_registry()
+    if args.show:
+        print(registry.get(args.show).text)
+        return
+    print(f"{'query':<46}{'bytes':>8}{'minified':>10}  sha256")
+    for query in registry.queries.values():
+        print(f"{query.file_name:<46}{query.original_size:>8}{len(query.text):>10}  {query.sha256}")
+
+
+if __name__ == '__main__':
+    main()
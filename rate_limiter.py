@@ -0,0 +1,187 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Markers of a Cloudflare challenge / block page instead of an API response
+CLOUDFLARE_MARKERS = ("Just a moment", "cf-chl", "Attention Required! | Cloudflare", "cf-browser-verification")
+
+
+# Raised when a request still fails after all retries
+class RateLimitExceeded(Exception):
+    def __init__(self, message, response=None):
+        super().__init__(message)
+        self.response = response
+
+
+# Classify failed response: "rate_limit", "server_error", "cloudflare" or "client_error"
+def classify_response(response):
+    if response.headers.get("cf-mitigated") == "challenge":
+        return "cloudflare"
+    if response.status_code in (403, 503) and any(marker in response.text for marker in CLOUDFLARE_MARKERS):
+        return "cloudflare"
+    if response.status_code == 429:
+        return "rate_limit"
+    if response.status_code >= 500:
+        return "server_error"
+    return "client_error"
+
+
+# Parse Retry-After header (seconds or HTTP date). Returns None if missing or invalid
+def parse_retry_after(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Token bucket shared by every request of a run.
+# Request rate grows additively while the API is healthy and is cut multiplicatively on failures (AIMD).
+class RateLimiter:
+    def __init__(self, delay=1, cool_down=1, max_retries=5, max_rate=None, burst=1, jitter=0.25,
+                 challenge_cool_down=60, max_backoff=120):
+        # Initial request rate comes from the old fixed delay between calls
+        self.base_rate = 1 / delay if delay > 0 else 10.0
+        self.rate = self.base_rate
+        self.min_rate = self.base_rate / 16
+        self.max_rate = max_rate if max_rate else self.base_rate * 4
+        self.burst = burst
+        self.jitter = jitter
+        self.cool_down = cool_down
+        self.max_retries = max_retries
+        self.challenge_cool_down = challenge_cool_down
+        self.max_backoff = max_backoff
+
+        self.slept = 0.0
+        self._tokens = burst
+        self._last_refill = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+            with self._lock:
+                self.slept += seconds
+            metrics.record_sleep(seconds)
+
+    # Block until a request may be sent. Tokens are reserved in call order so waiting threads are served FIFO
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            wait = max(wait, self._blocked_until - now)
+        self.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.base_rate * 0.1)
+
+    # Register failed response and return seconds to wait before retrying, or None if retrying is pointless
+    def on_failure(self, response, attempt):
+        kind = classify_response(response)
+        retry_after = parse_retry_after(response)
+
+        if kind == "client_error":
+            return None
+
+        if kind == "cloudflare":
+            factor = 0
+            wait = self.challenge_cool_down * (attempt + 1)
+        elif kind == "rate_limit":
+            factor = 0.5
+            wait = self.cool_down * 2 ** attempt
+        else:
+            factor = 0.8
+            wait = self.cool_down * 2 ** attempt
+
+        if retry_after is not None:
+            wait = retry_after
+        else:
+            wait = min(wait, self.max_backoff) * (1 + random.uniform(0, self.jitter))
+
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * factor)
+            # Pause every thread sharing this limiter, not only the one that got throttled
+            self._blocked_until = max(self._blocked_until, time.monotonic() + wait)
+
+        logger.warning(f"{kind} (HTTP {response.status_code}): retrying in {wait:.1f} second(s), rate now {self.rate:.2f} req/s")
+        return wait
+
+    # Register connection error or timeout and return seconds to wait before retrying
+    def on_error(self, attempt):
+        wait = min(self.cool_down * 2 ** attempt, self.max_backoff) * (1 + random.uniform(0, self.jitter))
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * 0.8)
+            self._blocked_until = max(self._blocked_until, time.monotonic() + wait)
+        logger.warning(f"Retrying in {wait:.1f} second(s)")
+        return wait
+
+
+
+# Shares one RateLimiter between several collections. Waiting requests are let into the token bucket
+# round-robin by collection, so a collection with many requests in flight can't starve the others.
+class FairScheduler:
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._condition = threading.Condition()
+        self._queues = {}
+        self._rotation = deque()
+        self._busy = False
+
+    def acquire(self, name):
+        ticket = object()
+        with self._condition:
+            if not self._queues.get(name):
+                self._queues[name] = deque()
+                self._rotation.append(name)
+            self._queues[name].append(ticket)
+            while self._busy or self._rotation[0] != name or self._queues[name][0] is not ticket:
+                self._condition.wait()
+            self._busy = True
+            self._queues[name].popleft()
+            self._rotation.popleft()
+            if self._queues[name]:
+                self._rotation.append(name)
+        try:
+            self.limiter.acquire()
+        finally:
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    # Limiter for one collection. Same interface as RateLimiter
+    def share(self, name):
+        return SharedLimiter(self, name)
+
+
+class SharedLimiter:
+    def __init__(self, scheduler, name):
+        self.scheduler = scheduler
+        self.name = name
+
+    def acquire(self):
+        self.scheduler.acquire(self.name)
+
+    # Backoff, rate and retry settings are shared by every collection
+    def __getattr__(self, attribute):
+        return getattr(self.scheduler.limiter, attribute)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from metrics import metrics
+from queries import query_hash
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_PATH = "response_cache.sqlite"
+
+# Seconds a response stays fresh, per operation. None means the search TTL (--response-cache-ttl).
+# Operations not listed, e.g. mutations, are never cached.
+OPERATION_TTLS = {
+    # contract address -> collection slug doesn't change
+    "NavSearchQuery": 7 * 24 * 3600,
+    "CollectionItemCountQuery": None,
+    "AssetSearchListUpdateQuery": None,
+    "AssetSearchListCheckQuery": None,
+}
+
+# Seconds an empty result (e.g. slug query of an unknown contract) stays fresh
+NEGATIVE_TTL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+# Stand-in for requests/httpx response of a cache hit. Only has what callers of GraphQLClient.post use
+class CachedResponse:
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode()
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# True if any connection in response data has no edges, e.g. no collection found for a contract address
+def _is_empty(data):
+    return any(isinstance(value, dict) and value.get("edges") == [] for value in data.values())
+
+
+# On-disk cache of read query responses, keyed by endpoint, operation, query text and variables.
+# Shared by every script and run through one SQLite file. Least recently used responses are evicted above max_bytes.
+class ResponseCache:
+    def __init__(self, path=RESPONSE_CACHE_PATH, search_ttl=600, max_bytes=200 * 1024 * 1024):
+        self.path = path
+        self.search_ttl = search_ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def ttl(self, operation):
+        if operation not in OPERATION_TTLS:
+            return None
+        ttl = OPERATION_TTLS[operation]
+        return self.search_ttl if ttl is None else ttl
+
+    def _key(self, url, operation, param):
+        key = json.dumps([url, operation, query_hash(param["query"]), param.get("variables")], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    # Cached response of request, None if not cached or expired
+    def get(self, url, operation, param):
+        if not self.ttl(operation):
+            return None
+        key = self._key(url, operation, param)
+        now = time.time()
+        with self._lock, self.connection:
+            row = self.connection.execute("SELECT body FROM responses WHERE key = ? AND expires > ?", (key, now)).fetchone()
+            if row is None:
+                metrics.increment("response_cache_misses")
+                return None
+            self.connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        metrics.increment("response_cache_hits")
+        return CachedResponse(row[0])
+
+    # Save successful response. Responses with GraphQL errors are not saved, empty results only for NEGATIVE_TTL
+    def put(self, url, operation, param, response):
+        ttl = self.ttl(operation)
+        if not ttl or response.status_code != 200:
+            return
+        body = response.content
+        try:
+            result = json.loads(body)
+        except ValueError:
+            return
+        data = result.get("data") if isinstance(result, dict) else None
+        if not isinstance(data, dict) or "errors" in result:
+            return
+        if _is_empty(data):
+            ttl = min(ttl, NEGATIVE_TTL)
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                                    (self._key(url, operation, param), operation, body, len(body), now + ttl, now))
+            self._evict(now)
+
+    # Drop expired responses, then least recently used ones until the cache fits in max_bytes
+    def _evict(self, now):
+        self.connection.execute("DELETE FROM responses WHERE expires <= ?", (now,))
+        excess = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0] - self.max_bytes
+        if excess <= 0:
+            return
+        evicted = 0
+        for key, size in self.connection.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if excess <= 0:
+                break
+            self.connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            excess -= size
+            evicted += 1
+        metrics.increment("response_cache_evictions", evicted)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+# Add response cache arguments shared by every script
+def add_cache_arguments(parser):
+    parser.add_argument('--response-cache',action='store_true',help=f'(optional) Save responses of read queries in "{RESPONSE_CACHE_PATH}" and reuse them on later runs while fresh. Collection slugs are kept for 7 days, unknown contracts for 1 hour.')
+    parser.add_argument('--response-cache-ttl',type=float,default=600,help="(optional) Seconds cached item counts and item pages stay fresh with '--response-cache'. Default is 600.")
+    parser.add_argument('--response-cache-size',type=float,default=200,help="(optional) Maximum size of '--response-cache' in MB. Least recently used responses are dropped first. Default is 200.")
+
+
+# Create cache from parsed script arguments. None if '--response-cache' is not set
+def create_cache(args):
+    if not args.response_cache:
+        return None
+    return ResponseCache(RESPONSE_CACHE_PATH, args.response_cache_ttl, int(args.response_cache_size * 1024 * 1024))
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+# Scripts live in the repository root and import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from client import GraphQLClient
+from mock_server import MockCollection, MockState, start_mock_server
+from rate_limiter import RateLimiter
+
+CONTRACT_ADDRESS = "0x" + "ab" * 20
+
+
+# Run every test in its own directory with an empty update_lists/
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("update_lists")
+    return tmp_path
+
+
+# Start mock server: mock(items, **MockState settings) returns (state, url)
+@pytest.fixture
+def mock():
+    servers = []
+
+    def start(items=1000, null_ratio=0.0, **settings):
+        state = MockState(MockCollection(items, null_ratio=null_ratio), **settings)
+        server, url = start_mock_server(state)
+        servers.append(server)
+        return state, url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+# Client without pacing worth waiting for in tests
+def create_test_client(url, max_retries=0, cool_down=0):
+    return GraphQLClient(RateLimiter(delay=0.001, cool_down=cool_down, max_retries=max_retries, max_rate=10000), url=url)
@@ -0,0 +1,113 @@
+import pytest
+
+from check import analyze_items, estimate_updated_share, scan_item_list, wilson_interval
+from checkpoint import CrawlCheckpoint
+from collection import create_items_list, sample_items
+from conftest import CONTRACT_ADDRESS, create_test_client
+from item_list import Item, dump_item, item_list_path, iter_update_items
+
+HASHES = [None, "QmNewHash", "QmMissingHash"]
+
+
+def page(updated, stale):
+    return [Item(f"r{index}", str(index), "ipfs://QmNewHash/") for index in range(updated)] + \
+           [Item(f"s{index}", str(index), "ipfs://QmOldHash/") for index in range(stale)]
+
+
+def test_wilson_interval():
+    low, high = wilson_interval(50, 100)
+    assert low == pytest.approx(0.404, abs=0.001)
+    assert high == pytest.approx(0.596, abs=0.001)
+    assert wilson_interval(0, 0) == (0.0, 1.0)
+    assert wilson_interval(20, 20)[1] == 1.0
+
+
+def test_estimate_without_items_is_none():
+    assert estimate_updated_share([], "QmNewHash") is None
+    assert estimate_updated_share([[], []], "QmNewHash") is None
+
+
+def test_estimate_counts_items_without_metadata_as_stale():
+    estimate = estimate_updated_share([page(3, 0) + [Item("m", "9")]], "QmNewHash")
+    assert estimate["estimate"] == 0.75
+    assert estimate["sampled_items"] == 4
+
+
+def test_clustered_pages_widen_interval():
+    # Same share of updated items, spread evenly or clustered by page
+    even = estimate_updated_share([page(10, 10) for _ in range(10)], "QmNewHash")
+    clustered = estimate_updated_share([page(20, 0) for _ in range(5)] + [page(0, 20) for _ in range(5)], "QmNewHash")
+    assert even["estimate"] == clustered["estimate"] == 0.5
+    assert even["design_effect"] == 1.0
+    assert clustered["design_effect"] > 10
+    assert clustered["high"] - clustered["low"] > 2 * (even["high"] - even["low"])
+
+
+def test_sample_estimate_covers_share_of_mock_collection(mock):
+    state, url = mock(5000)
+    pages = sample_items(create_test_client(url), "mock-collection", 5000, 40, 20, seed=1)
+    assert len(pages) == 40
+    estimate = estimate_updated_share(pages, "QmNewHash")
+    assert estimate["sampled_items"] == 800
+    assert estimate["low"] <= len(state.collection.revealed_ids) / 5000 <= estimate["high"]
+
+
+def write_item_list(items):
+    path = item_list_path(CONTRACT_ADDRESS)
+    with open(path, 'w') as file:
+        for item in items:
+            file.write(dump_item(item))
+    return path
+
+
+@pytest.mark.parametrize("new_hash", HASHES)
+def test_scan_matches_analyze_on_crawled_list(mock, new_hash):
+    _, url = mock(1000, null_ratio=0.05)
+    checkpoint = CrawlCheckpoint(CONTRACT_ADDRESS)
+    create_items_list(create_test_client(url), "mock-collection", 1000, 100, checkpoint)
+    path = checkpoint.finalize()
+    report = scan_item_list(path, new_hash)
+    assert report == analyze_items(iter_update_items(CONTRACT_ADDRESS), new_hash)
+    assert report["missing_count"] > 0
+
+
+@pytest.mark.parametrize("new_hash", HASHES)
+def test_scan_matches_analyze_on_edge_cases(new_hash):
+    items = [
+        Item("a1", "1", "ipfs://QmNewHash/1"),
+        Item("a3", "3", "ipfs://QmOldHash/3"),
+        Item("a3b", "3", "ipfs://QmOldHash/3"),
+        Item("ax", "not-a-number", "ipfs://QmNewHash/x"),
+        Item("a7", "7"),
+        Item("a8", "8", ""),
+        Item("a9", "115792089237316195423570985008687907853269984665640564039457584007913129639935", "ipfs://QmNewHash/9"),
+        # Json metadata: quotes are escaped in the item list line
+        Item("a10", "10", 'data:application/json,{"image":"ipfs://QmNewHash/10"}'),
+        Item("a11", "11", 'data:application/json,{"image":"ipfs://QmOldHash/11","note":"QmNewHash\\"}'),
+        Item("a12", "12", 'data:application/json,{"name":"\\"}QmNewHash'),
+    ]
+    path = write_item_list(items)
+    report = scan_item_list(path, new_hash)
+    assert report == analyze_items(iter_update_items(CONTRACT_ADDRESS), new_hash)
+    assert report["duplicated"] == ["3"]
+    assert report["parse_fail_count"] == 1
+    assert scan_item_list(path, new_hash, with_stale=False) == {**report, "stale": []}
+
+
+def test_scan_finds_hash_in_json_metadata():
+    path = write_item_list([Item("a1", "1", 'data:application/json,{"image":"ipfs://QmNewHash/1"}')])
+    assert scan_item_list(path, "QmNewHash")["new_hash_count"] == 1
+    assert scan_item_list(path, "QmNewHash", with_stale=False)["new_hash_count"] == 1
+
+
+def test_scan_without_stale_ids_counts_new_hash():
+    path = write_item_list([Item("a1", "1", "ipfs://QmNewHash/1"), Item("a2", "2", "ipfs://QmOldHash/2")])
+    report = scan_item_list(path, "QmNewHash", with_stale=False)
+    expected = analyze_items(iter_update_items(CONTRACT_ADDRESS), "QmNewHash")
+    assert report == {**expected, "stale": []}
+
+
+@pytest.mark.parametrize("new_hash", HASHES)
+def test_scan_matches_analyze_on_empty_list(new_hash):
+    path = write_item_list([])
+    assert scan_item_list(path, new_hash) == analyze_items([], new_hash)
@@ -0,0 +1,178 @@
+import os
+
+from checkpoint import CrawlCheckpoint
+from client import create_client
+from collection import crawl_concurrency, create_items_list, create_items_list_bidirectional, cursor_offset, offset_cursor, reanchor_cursor
+from conftest import CONTRACT_ADDRESS, create_test_client
+from item_list import iter_update_items
+from item_store import ItemStore
+from mock_server import MockCollection
+from update import create_argument_parser
+
+
+def crawl(url, total_count, resume=False, delta=False, **settings):
+    checkpoint = CrawlCheckpoint(CONTRACT_ADDRESS, resume=resume, delta=delta)
+    create_items_list(create_test_client(url, **settings), "mock-collection", total_count, 100, checkpoint)
+    return checkpoint
+
+
+def token_ids(items):
+    return [int(item.token_id) for item in items]
+
+
+def test_resume_continues_from_last_saved_page(mock):
+    state, url = mock(1000, rate_limit_every=5)
+    checkpoint = crawl(url, 1000)
+    assert not checkpoint.finished
+    assert checkpoint.item_count == 400
+
+    state.rate_limit_every = 0
+    requests_before = state.request_count
+    checkpoint = crawl(url, 1000, resume=True)
+    assert checkpoint.finished
+    # Only the 6 missing pages are asked again
+    assert state.request_count - requests_before == 6
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(1000))
+
+
+def test_resume_drops_page_written_after_last_saved_state(mock):
+    state, url = mock(500, rate_limit_every=4)
+    checkpoint = crawl(url, 500)
+    assert checkpoint.item_count == 300
+    # Crash between appending a page and saving the state
+    with open(checkpoint.items_path, 'a') as file:
+        file.write('{"relayId": "partial", "tokenId": "9999"}\n')
+
+    state.rate_limit_every = 0
+    checkpoint = crawl(url, 500, resume=True)
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(500))
+
+
+def test_delta_crawl_adds_new_items(mock):
+    state, url = mock(500)
+    crawl(url, 500).finalize()
+
+    # New items minted after the saved list
+    state.collection = MockCollection(730)
+    requests_before = state.request_count
+    checkpoint = crawl(url, 730, delta=True)
+    assert checkpoint.finished
+    # Only pages after the saved list are asked
+    assert state.request_count - requests_before == 3
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(730))
+
+
+def test_delta_crawl_merges_items_already_in_list(mock):
+    state, url = mock(500)
+    crawl(url, 500).finalize()
+
+    # Offsets moved back: first delta page repeats 50 saved items
+    state.collection = MockCollection(700)
+    state.cursor_shift = 50
+    checkpoint = crawl(url, 700, delta=True)
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(700))
+
+
+def test_delta_crawl_without_saved_cursor_crawls_whole_collection(mock):
+    _, url = mock(300)
+    checkpoint = crawl(url, 300, delta=True)
+    assert not checkpoint.delta
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(300))
+
+
+def test_delta_crawl_updates_item_store(mock):
+    state, url = mock(500)
+    crawl(url, 500).finalize(store=True)
+
+    state.collection = MockCollection(600)
+    crawl(url, 600, delta=True).finalize()
+    with ItemStore(CONTRACT_ADDRESS) as item_store:
+        assert item_store.count() == 600
+
+
+def test_bidirectional_crawl_meets_in_the_middle(mock):
+    _, url = mock(1050)
+    checkpoint = CrawlCheckpoint(CONTRACT_ADDRESS)
+    create_items_list_bidirectional(create_test_client(url), "mock-collection", 1050, 100, checkpoint)
+    assert checkpoint.finished
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(1050))
+
+
+def test_failed_bidirectional_crawl_is_not_resumed(mock):
+    state, url = mock(1000, rate_limit_every=4)
+    checkpoint = CrawlCheckpoint(CONTRACT_ADDRESS)
+    items = create_items_list_bidirectional(create_test_client(url), "mock-collection", 1000, 100, checkpoint)
+    assert list(items) == []
+    assert not checkpoint.finished
+    assert not os.path.exists(checkpoint.state_path)
+
+    # '--resume' finds no checkpoint and crawls the whole collection
+    state.rate_limit_every = 0
+    checkpoint = crawl(url, 1000, resume=True)
+    assert checkpoint.finished
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(1000))
+
+
+def test_bidirectional_crawl_keeps_connection_per_chain(mock, caplog):
+    _, url = mock(1000, latency=0.05)
+    args = create_argument_parser().parse_args(["-c", CONTRACT_ADDRESS, "--create-list", "--bidirectional", "--api-url", url, "--delay", "0.001"])
+    client = create_client(args, max(args.concurrency, crawl_concurrency(args.bidirectional)))
+    assert client.limiter.burst == 2
+    items = create_items_list_bidirectional(client, "mock-collection", 1000, 100)
+    assert len(items) == 1000
+    assert "Connection pool is full" not in caplog.text
+
+
+def test_duplicate_pages_are_dropped(mock):
+    state, url = mock(2000, null_ratio=0.02, duplicate_page_ratio=0.2)
+    items = create_items_list(create_test_client(url), "mock-collection", 2000, 100)
+    expected = [i for i in range(2000) if i not in state.collection.null_ids]
+    assert token_ids(items) == expected
+
+
+def test_partly_shifted_cursor_follows_end_cursor(mock):
+    # Cursors drift back 60 items at offset 300: next page repeats 60 items and has 40 new ones
+    _, url = mock(1000, cursor_shift=60, shift_at=300)
+    items = create_items_list(create_test_client(url), "mock-collection", 1000, 100)
+    assert token_ids(items) == list(range(1000))
+
+
+def test_fully_shifted_cursor_reanchors_after_found_items(mock):
+    # Page after the shift only repeats seen items
+    _, url = mock(1000, cursor_shift=150, shift_at=300)
+    items = create_items_list(create_test_client(url), "mock-collection", 1000, 100)
+    assert token_ids(items) == list(range(1000))
+
+
+def test_resume_after_drift_does_not_repeat_page(mock):
+    state, url = mock(1000, cursor_shift=150, shift_at=300)
+    # Interrupted right after the repeated page
+    state.rate_limit_every = 5
+    checkpoint = crawl(url, 1000)
+    assert not checkpoint.finished
+    assert checkpoint.item_count == 300
+    assert cursor_offset(checkpoint.cursor) > 300
+
+    state.rate_limit_every = 0
+    checkpoint = crawl(url, 1000, resume=True)
+    assert checkpoint.finished
+    checkpoint.finalize()
+    assert token_ids(iter_update_items(CONTRACT_ADDRESS)) == list(range(1000))
+
+
+def test_reanchor_cursor():
+    # Server answered an earlier page: continue after the items found
+    assert reanchor_cursor(offset_cursor(300), offset_cursor(300), 300) == offset_cursor(300)
+    # Offsets shifted forward: follow the end cursor
+    assert reanchor_cursor(offset_cursor(300), offset_cursor(450), 300) == offset_cursor(450)
+    assert reanchor_cursor(offset_cursor(300), offset_cursor(200), 350) == offset_cursor(350)
+    # Opaque cursors
+    assert reanchor_cursor("abc", "def", 300) == "def"
+    assert reanchor_cursor("abc", "abc", 300) is None
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+
+from conftest import CONTRACT_ADDRESS, create_test_client
+from daemon import RefreshHandler, RefreshQueue, TokenResolver, flush_loop
+from item_list import Item, dump_item, item_list_path, iter_dead_letter_items
+from item_store import ItemStore
+from mock_server import MockCollection
+
+ITEMS = [Item(MockCollection().relay_id(index), str(index)) for index in range(20)]
+
+
+def write_item_list(items):
+    with open(item_list_path(CONTRACT_ADDRESS), 'w') as file:
+        for item in items:
+            file.write(dump_item(item))
+
+
+def test_resolver_normalizes_token_ids():
+    write_item_list(ITEMS)
+    items, unknown = TokenResolver().resolve(CONTRACT_ADDRESS, ["1", 7, "007", "x", True, "999", -2])
+    assert sorted(item.token_id for item in items) == ["1", "7"]
+    # Unknown ids are returned as sent
+    assert unknown == ["x", True, -2, "999"]
+
+
+def test_resolver_reloads_changed_item_list():
+    write_item_list(ITEMS[:5])
+    resolver = TokenResolver()
+    assert resolver.resolve(CONTRACT_ADDRESS, ["12"]) == ([], ["12"])
+    write_item_list(ITEMS)
+    modified = os.path.getmtime(item_list_path(CONTRACT_ADDRESS)) + 10
+    os.utime(item_list_path(CONTRACT_ADDRESS), (modified, modified))
+    assert resolver.resolve(CONTRACT_ADDRESS, ["12"]) == ([ITEMS[12]], [])
+
+
+def test_resolver_reads_item_store():
+    with ItemStore(CONTRACT_ADDRESS) as store:
+        store.replace(ITEMS)
+    items, unknown = TokenResolver().resolve(CONTRACT_ADDRESS, ["003", 4, "50"])
+    assert sorted(item.token_id for item in items) == ["3", "4"]
+    assert unknown == ["50"]
+
+
+def test_resolver_without_item_list_raises():
+    with pytest.raises(FileNotFoundError):
+        TokenResolver().resolve(CONTRACT_ADDRESS, ["1"])
+
+
+def test_queue_deduplicates_by_relay_id():
+    queue = RefreshQueue(batch_size=10)
+    assert queue.add("0xa", ITEMS[:3]) == 3
+    assert queue.add("0xa", ITEMS[1:5]) == 2
+    assert queue.add("0xb", ITEMS[:1]) == 1
+    assert queue.status() == {"0xa": 5, "0xb": 1}
+
+
+def test_queue_flushes_full_batch_right_away():
+    queue = RefreshQueue(batch_size=5, debounce=60, max_delay=60)
+    queue.add("0xa", ITEMS[:5])
+    assert queue.take() == ("0xa", ITEMS[:5])
+
+
+def test_queue_flushes_after_debounce():
+    queue = RefreshQueue(batch_size=100, debounce=0.2, max_delay=60)
+    queue.add("0xa", ITEMS[:2])
+    start = time.monotonic()
+    assert queue.take() == ("0xa", ITEMS[:2])
+    assert 0.15 <= time.monotonic() - start < 2
+
+
+def test_queue_flushes_at_max_delay_while_requests_keep_coming():
+    queue = RefreshQueue(batch_size=100, debounce=0.3, max_delay=0.5)
+    stop = threading.Event()
+
+    def keep_adding():
+        for item in ITEMS:
+            if stop.is_set():
+                return
+            queue.add("0xa", [item])
+            time.sleep(0.05)
+
+    adder = threading.Thread(target=keep_adding)
+    start = time.monotonic()
+    adder.start()
+    contract_address, items = queue.take()
+    stop.set()
+    adder.join()
+    assert contract_address == "0xa"
+    assert 0.45 <= time.monotonic() - start < 0.9
+    assert 5 <= len(items) < 20
+
+
+def test_closed_queue_returns_pending_items_then_none():
+    queue = RefreshQueue(batch_size=100, debounce=60, max_delay=60)
+    queue.add("0xa", ITEMS[:2])
+    queue.close()
+    assert queue.take() == ("0xa", ITEMS[:2])
+    assert queue.take() is None
+
+
+class FlushArguments:
+    batch_size = 10
+    target_latency = 10
+    fixed_batch_size = True
+    concurrency = 1
+    item_retries = 0
+    mutation_form = "inline"
+    mutation_cache = False
+
+
+@pytest.fixture
+def daemon(mock):
+    state, url = mock(20, bad_relay_ids=[ITEMS[4].relay_id])
+    write_item_list(ITEMS)
+    queue = RefreshQueue(batch_size=10, debounce=0.1, max_delay=1)
+    flusher = threading.Thread(target=flush_loop, args=(queue, create_test_client(url), FlushArguments()))
+    flusher.start()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RefreshHandler)
+    server.daemon_threads = True
+    server.queue = queue
+    server.resolver = TokenResolver()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield state, queue, flusher, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    queue.close()
+    flusher.join(5)
+
+
+def test_daemon_queues_requested_tokens(daemon):
+    state, queue, flusher, url = daemon
+    response = requests.post(f"{url}/refresh", json={"contract_address": CONTRACT_ADDRESS, "token_ids": ["1", "2", "02", "4", "77"]})
+    assert response.status_code == 202
+    assert response.json() == {"queued": 3, "already_pending": 0, "unknown": ["77"]}
+    # Pending items are flushed on close
+    queue.close()
+    flusher.join(5)
+    assert state.refreshed_count == 2
+    assert list(iter_dead_letter_items(CONTRACT_ADDRESS)) == [ITEMS[4]]
+
+
+@pytest.mark.parametrize("body", [
+    {"contract_address": "../../etc/passwd", "token_ids": ["1"]},
+    {"contract_address": CONTRACT_ADDRESS[:-1], "token_ids": ["1"]},
+    {"token_ids": ["1"]},
+])
+def test_daemon_rejects_invalid_requests(daemon, body):
+    url = daemon[-1]
+    response = requests.post(f"{url}/refresh", data=json.dumps(body))
+    assert response.status_code == 400
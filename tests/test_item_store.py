@@ -0,0 +1,64 @@
+import pytest
+
+from conftest import CONTRACT_ADDRESS
+from item_list import Item
+from item_store import ItemStore, in_token_ranges, parse_token_ranges
+from update import create_argument_parser, select_items
+
+BIG_TOKEN_ID = str(2 ** 256 - 1)
+
+
+def test_parse_token_ranges():
+    assert parse_token_ranges("500-620,900") == [(500, 620), (900, 900)]
+    # Sorted and merged when overlapping or adjacent
+    assert parse_token_ranges("900, 10-20,15-30,31,") == [(10, 31), (900, 900)]
+    assert parse_token_ranges(f"{BIG_TOKEN_ID}") == [(2 ** 256 - 1, 2 ** 256 - 1)]
+
+
+@pytest.mark.parametrize("text", ["20-10", "a-b", "5-", "-5"])
+def test_parse_token_ranges_rejects_invalid_ranges(text):
+    with pytest.raises(ValueError):
+        parse_token_ranges(text)
+
+
+def test_in_token_ranges():
+    ranges = parse_token_ranges("10-20,900")
+    assert in_token_ranges("10", ranges)
+    assert in_token_ranges("900", ranges)
+    assert not in_token_ranges("21", ranges)
+    assert not in_token_ranges("abc", ranges)
+
+
+def store_items():
+    items = [Item(f"r{token_id}", str(token_id), f"ipfs://Qm/{token_id}") for token_id in (1, 2, 9, 10, 11, 100, 1000)]
+    return items + [Item("rbig", BIG_TOKEN_ID), Item("rname", "not-a-number")]
+
+
+def test_item_store_range_queries_sort_numerically():
+    with ItemStore(CONTRACT_ADDRESS) as store:
+        assert store.replace(store_items()) == 9
+        # Text sort would put 1000 before 11
+        assert [item.token_id for item in store.iter_token_ranges([(2, 1000)])] == ["2", "9", "10", "11", "100", "1000"]
+        assert [item.token_id for item in store.iter_token_ranges(parse_token_ranges(f"1,{BIG_TOKEN_ID}"))] == ["1", BIG_TOKEN_ID]
+        assert store.count_token_ranges(parse_token_ranges("1-10,100")) == 5
+        assert sorted(item.token_id for item in store.get_tokens(["9", "0011", "x", "5"])) == ["11", "9"]
+
+
+def test_item_store_upsert_keeps_saved_metadata():
+    with ItemStore(CONTRACT_ADDRESS) as store:
+        store.replace(store_items())
+        assert store.upsert([Item("r1", "1"), Item("r2", "2", "ipfs://QmNew/2"), Item("r3", "3")]) == 3
+        items = {item.token_id: item for item in store.iter_token_ranges([(1, 3)])}
+        assert items["1"].token_metadata == "ipfs://Qm/1"
+        assert items["2"].token_metadata == "ipfs://QmNew/2"
+        assert items["3"].token_metadata is None
+        assert store.count() == 10
+
+
+def test_select_items_reads_token_ranges_from_store():
+    with ItemStore(CONTRACT_ADDRESS) as store:
+        store.replace(store_items())
+    args = create_argument_parser().parse_args(["-c", CONTRACT_ADDRESS, "--update_metadata", "--tokens", "9-11,1000"])
+    load_items, total = select_items(args)
+    assert total == 4
+    assert [item.token_id for item in load_items()] == ["9", "10", "11", "1000"]
@@ -0,0 +1,62 @@
+import json
+import re
+import sys
+
+import check
+from metrics import Metrics, metrics
+
+
+def test_prometheus_groups_samples_by_metric():
+    run_metrics = Metrics()
+    run_metrics.record_request("AssetSearchListCheckQuery", "200", 0.2)
+    run_metrics.start_phase("crawl", 300, collection="0xa")
+    run_metrics.set_progress("crawl", 100, collection="0xa")
+    run_metrics.start_phase("refresh", None, collection="0xb")
+    lines = run_metrics.prometheus().splitlines()
+
+    types = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+    samples = [re.match(r"[a-z_]+", line).group() for line in lines if not line.startswith("#")]
+    assert len(types) == len(set(types))
+    for name in ("opensea_items_done", "opensea_items_total", "opensea_items_per_second", "opensea_eta_seconds"):
+        assert name in types
+    # Samples of a metric follow its TYPE line without other metrics in between
+    current = None
+    for line in lines:
+        if line.startswith("# TYPE"):
+            current = line.split()[2]
+        else:
+            assert re.match(r"[a-z_]+", line).group().startswith(current)
+    assert samples.count("opensea_items_done") == 2
+    # Unknown total has no sample
+    assert 'opensea_items_total{phase="refresh",collection="0xb"}' not in "\n".join(lines)
+
+
+def run_check(monkeypatch, *argv):
+    metrics.reset()
+    monkeypatch.setattr(sys, "argv", ["check.py", *argv])
+    check.main()
+
+
+def test_check_writes_stats_file_on_uri_check(monkeypatch):
+    open("update_lists/0x1_item_list.jsonl", "w").close()
+    run_check(monkeypatch, "-c", "0x1", "-u", "-s", "QmNewHash", "--stats-file", "stats.json")
+    with open("stats.json") as file:
+        assert "requests" in json.load(file)
+
+
+def test_check_writes_stats_file_after_crawl(mock, monkeypatch):
+    _, url = mock(300)
+    run_check(monkeypatch, "-c", "0x1", "--api-url", url, "--delay", "0.001", "--stats-file", "stats.json")
+    with open("stats.json") as file:
+        stats = json.load(file)
+    assert [progress["done"] for progress in stats["progress"] if progress["phase"] == "crawl"] == [300]
+
+
+def test_check_writes_stats_file_when_collection_is_not_found(mock, monkeypatch):
+    # Every request is throttled, so the slug query fails
+    _, url = mock(300, rate_limit_every=1)
+    run_check(monkeypatch, "-c", "0x1", "--api-url", url, "--delay", "0.001", "--max-retries", "0", "--stats-file", "stats.json")
+    with open("stats.json") as file:
+        stats = json.load(file)
+    assert stats["requests"][0]["status"] == "429"
+    assert stats["progress"] == []
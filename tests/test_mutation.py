@@ -0,0 +1,68 @@
+import os
+
+from conftest import CONTRACT_ADDRESS
+from item_list import Item
+from manual_mutation import create_mutation, manual_mutation_directory
+from metrics import metrics
+from mutation import MutationCompiler, batch_key, build_inline_document
+
+ITEMS = [Item(f"relay{index}", str(index)) for index in range(25)]
+
+
+def test_mutation_cache_reuses_documents_by_item_ids():
+    metrics.reset()
+    compiler = MutationCompiler(cache_directory="mutation_cache")
+    first = compiler.compile(ITEMS[:10])
+    assert first.query == build_inline_document(ITEMS[:10])
+    assert os.path.exists(compiler._cache_path(batch_key(ITEMS[:10])))
+
+    # A new compiler reads the saved document
+    second = MutationCompiler(cache_directory="mutation_cache").compile(ITEMS[:10])
+    assert second.query == first.query
+    assert second.aliases == first.aliases
+    assert metrics.snapshot()["counters"] == {"mutation_cache_misses": 1, "mutation_cache_hits": 1}
+
+
+def test_mutation_cache_key_depends_on_ids_and_order():
+    assert batch_key(ITEMS[:10]) != batch_key(ITEMS[1:11])
+    assert batch_key(ITEMS[:10]) != batch_key(ITEMS[:10][::-1])
+    assert batch_key(ITEMS[:2]) != batch_key([ITEMS[0], Item("relay1", "100")])
+    compiler = MutationCompiler(cache_directory="mutation_cache")
+    assert compiler.compile(ITEMS[:10][::-1]).query == build_inline_document(ITEMS[:10][::-1])
+
+
+def read_mutation_file(index, extension="graphql"):
+    with open(f"{manual_mutation_directory(CONTRACT_ADDRESS)}/{index}.{extension}") as file:
+        return file.read()
+
+
+def mark_mutation_files():
+    for index in (1, 2, 3):
+        with open(f"{manual_mutation_directory(CONTRACT_ADDRESS)}/{index}.graphql", 'w') as file:
+            file.write("unchanged")
+
+
+def test_manual_mutation_only_rewrites_changed_batches():
+    create_mutation(CONTRACT_ADDRESS, ITEMS, 10)
+    assert read_mutation_file(3) == build_inline_document(ITEMS[20:])
+    mark_mutation_files()
+
+    changed = list(ITEMS[:20])
+    changed[15] = Item("relay15b", "15")
+    create_mutation(CONTRACT_ADDRESS, changed, 10)
+    assert read_mutation_file(1) == "unchanged"
+    assert read_mutation_file(2) == build_inline_document(changed[10:])
+    # Batch 3 no longer exists
+    assert not os.path.exists(f"{manual_mutation_directory(CONTRACT_ADDRESS)}/3.graphql")
+
+
+def test_manual_mutation_rewrites_batches_when_form_changes():
+    create_mutation(CONTRACT_ADDRESS, ITEMS, 10)
+    mark_mutation_files()
+    create_mutation(CONTRACT_ADDRESS, ITEMS, 10, MutationCompiler("variables"))
+    assert read_mutation_file(1).startswith("mutation RefreshAssets(")
+    assert '"relay0"' in read_mutation_file(1, "json")
+
+    create_mutation(CONTRACT_ADDRESS, ITEMS, 10)
+    assert read_mutation_file(1) == build_inline_document(ITEMS[:10])
+    assert not os.path.exists(f"{manual_mutation_directory(CONTRACT_ADDRESS)}/1.json")
@@ -0,0 +1,68 @@
+import pytest
+
+from client import GraphQLClient
+from collection import get_collection_detail
+from metrics import metrics
+from queries import QueryRegistry, minify_query, query_hash
+from rate_limiter import RateLimiter
+
+
+def test_minify_query_drops_insignificant_characters():
+    text = '''
+    # Search items
+    query Search($count: Int = 10, $cursor: String) {
+      search(first: $count, after: $cursor, sort: {by: "created, date"}) {
+        edges { node { ...AssetFields } }
+      }
+    }
+    '''
+    assert minify_query(text) == 'query Search($count:Int=10$cursor:String){search(first:$count after:$cursor sort:{by:"created, date"}){edges{node{...AssetFields}}}}'
+    assert minify_query(minify_query(text)) == minify_query(text)
+
+
+def test_minify_query_keeps_strings():
+    assert minify_query('{ a(s: "x # not a comment, \\" y") }') == '{a(s:"x # not a comment, \\" y")}'
+    assert minify_query('{ a(s: """ block, "quoted" """) }') == '{a(s:""" block, "quoted" """)}'
+
+
+@pytest.mark.parametrize("text", ['{ a ', '{ a ) }', 'query { a(s: "open) }', 'query { a; }', 'a { b }'])
+def test_minify_query_rejects_invalid_queries(text):
+    with pytest.raises(ValueError):
+        minify_query(text)
+
+
+def test_registry_minifies_every_query_file():
+    registry = QueryRegistry()
+    assert registry.queries
+    for query in registry.queries.values():
+        assert len(query.text) < query.original_size
+        assert query.sha256 == query_hash(query.text)
+
+
+def persisted_client(url):
+    return GraphQLClient(RateLimiter(delay=0.001, max_retries=0, max_rate=10000), url=url, persisted_queries=True)
+
+
+def test_persisted_query_registers_text_once(mock):
+    metrics.reset()
+    state, url = mock(300)
+    client = persisted_client(url)
+    assert get_collection_detail(client, "0x1") == ("mock-collection", 300)
+    # Hash miss, then hash with text, for each of the two queries
+    assert state.request_count == 4
+    assert len(state.persisted_queries) == 2
+
+    assert get_collection_detail(client, "0x1") == ("mock-collection", 300)
+    assert state.request_count == 6
+    counters = metrics.snapshot()["counters"]
+    assert counters["persisted_query_misses"] == 2
+    assert counters["persisted_query_hits"] == 2
+
+
+def test_persisted_queries_fall_back_to_text_when_not_supported(mock):
+    state, url = mock(300, persisted_queries_supported=False)
+    client = persisted_client(url)
+    assert get_collection_detail(client, "0x1") == ("mock-collection", 300)
+    assert not client.persisted_queries
+    # Only the first query tried the hash
+    assert state.request_count == 3
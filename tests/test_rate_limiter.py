@@ -0,0 +1,100 @@
+import threading
+import time
+from email.utils import formatdate
+
+import pytest
+import requests
+
+from client import GraphQLClient
+from collection import create_items_list
+from rate_limiter import FairScheduler, RateLimiter, RateLimitExceeded, parse_retry_after
+
+
+def response_with(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response._content = b""
+    return response
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(response_with(429, {"Retry-After": "3"})) == 3
+    assert parse_retry_after(response_with(429, {"Retry-After": "-1"})) == 0
+    assert 8 <= parse_retry_after(response_with(429, {"Retry-After": formatdate(time.time() + 10, usegmt=True)})) <= 10
+    assert parse_retry_after(response_with(429, {"Retry-After": "soon"})) is None
+    assert parse_retry_after(response_with(429)) is None
+
+
+def test_retry_after_replaces_backoff_and_halves_rate():
+    limiter = RateLimiter(delay=0.1, cool_down=30)
+    wait = limiter.on_failure(response_with(429, {"Retry-After": "2"}), attempt=3)
+    assert wait == 2
+    assert limiter.rate == pytest.approx(5)
+
+
+def test_client_waits_retry_after_from_server(mock):
+    state, url = mock(300, rate_limit_every=3, retry_after=0.3)
+    # Backoff without Retry-After would be 30 seconds
+    limiter = RateLimiter(delay=0.001, cool_down=30, max_retries=1, max_rate=10000)
+    items = create_items_list(GraphQLClient(limiter, url=url), "mock-collection", 300, 100)
+    assert len(items) == 300
+    assert state.rate_limited_count == 1
+    # Pause is measured up to the deadline set when the 429 arrived
+    assert 0.25 <= limiter.slept < 5
+
+
+def test_client_gives_up_after_max_retries(mock):
+    state, url = mock(300, rate_limit_every=1, retry_after=0.01)
+    limiter = RateLimiter(delay=0.001, cool_down=30, max_retries=2, max_rate=10000)
+    with pytest.raises(RateLimitExceeded):
+        GraphQLClient(limiter, url=url).post({"query": "query { collection }", "variables": {}})
+    assert state.request_count == 3
+
+
+# Limiter recording which thread got each token. The first token is held until gate is set
+class GateLimiter:
+    def __init__(self):
+        self.gate = threading.Event()
+        self.order = []
+
+    def acquire(self):
+        self.order.append(threading.current_thread().name)
+        if len(self.order) == 1:
+            self.gate.wait(5)
+
+
+def start_waiting(scheduler, name, thread_name):
+    queued = len(scheduler._queues.get(name, ()))
+    thread = threading.Thread(target=scheduler.share(name).acquire, name=thread_name)
+    thread.start()
+    # Wait until the request is queued so the arrival order is fixed
+    while len(scheduler._queues.get(name, ())) == queued:
+        time.sleep(0.001)
+    return thread
+
+
+def test_fair_scheduler_takes_turns_between_collections():
+    limiter = GateLimiter()
+    scheduler = FairScheduler(limiter)
+    first = threading.Thread(target=scheduler.share("a").acquire, name="a0")
+    first.start()
+    while not limiter.order:
+        time.sleep(0.001)
+
+    threads = [start_waiting(scheduler, "a", f"a{i}") for i in range(1, 5)]
+    threads += [start_waiting(scheduler, "b", f"b{i}") for i in range(1, 3)]
+    limiter.gate.set()
+    for thread in [first, *threads]:
+        thread.join(5)
+    # Collection "a" queued four requests before "b" queued any, yet "b" isn't starved
+    assert limiter.order == ["a0", "a1", "b1", "a2", "b2", "a3", "a4"]
+
+
+def test_shared_limiter_uses_settings_of_scheduler_limiter():
+    limiter = RateLimiter(delay=0.5, cool_down=7, max_retries=2)
+    shared = FairScheduler(limiter).share("a")
+    assert shared.cool_down == 7
+    assert shared.max_retries == 2
+    shared.on_success()
+    assert limiter.rate > limiter.base_rate
@@ -0,0 +1,112 @@
+import json
+import time
+
+import pytest
+import requests
+
+from client import GraphQLClient
+from collection import create_items_list
+from conftest import CONTRACT_ADDRESS
+from metrics import metrics
+from rate_limiter import RateLimiter
+from response_cache import NEGATIVE_TTL, ResponseCache
+from update import create_argument_parser, create_list
+
+URL = "http://127.0.0.1/graphql/"
+PAGE_QUERY = "query AssetSearchListCheckQuery($cursor:String){search(after:$cursor){edges{node{asset{tokenId}}}}}"
+SLUG_QUERY = "query NavSearchQuery($query:String!){collections(query:$query){edges{node{slug}}}}"
+
+
+def response_with(body, status_code=200):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode()
+    return response
+
+
+def page_param(cursor):
+    return {"query": PAGE_QUERY, "variables": {"cursor": cursor}}
+
+
+def page_response(size=1):
+    return response_with({"data": {"search": {"edges": [{"node": {"asset": {"tokenId": "1"}}}] * size}}})
+
+
+def expiry(cache, operation):
+    return cache.connection.execute("SELECT expires - accessed FROM responses WHERE operation = ?", (operation,)).fetchone()[0]
+
+
+def test_cache_returns_fresh_responses_until_ttl():
+    cache = ResponseCache("cache.sqlite", search_ttl=0.2)
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("a"), page_response())
+    assert cache.get(URL, "AssetSearchListCheckQuery", page_param("a")).json() == page_response().json()
+    # Key includes variables and endpoint
+    assert cache.get(URL, "AssetSearchListCheckQuery", page_param("b")) is None
+    assert cache.get("http://other/graphql/", "AssetSearchListCheckQuery", page_param("a")) is None
+    time.sleep(0.25)
+    assert cache.get(URL, "AssetSearchListCheckQuery", page_param("a")) is None
+
+
+def test_cache_ttl_per_operation():
+    cache = ResponseCache("cache.sqlite", search_ttl=600)
+    cache.put(URL, "NavSearchQuery", {"query": SLUG_QUERY, "variables": {"query": "0x1"}}, response_with({"data": {"collections": {"edges": [{"node": {"slug": "a"}}]}}}))
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("a"), page_response())
+    assert expiry(cache, "NavSearchQuery") == pytest.approx(7 * 24 * 3600)
+    assert expiry(cache, "AssetSearchListCheckQuery") == pytest.approx(600)
+
+
+def test_cache_keeps_empty_results_for_negative_ttl():
+    cache = ResponseCache("cache.sqlite")
+    param = {"query": SLUG_QUERY, "variables": {"query": "0xunknown"}}
+    cache.put(URL, "NavSearchQuery", param, response_with({"data": {"collections": {"edges": []}}}))
+    assert cache.get(URL, "NavSearchQuery", param) is not None
+    assert expiry(cache, "NavSearchQuery") == pytest.approx(NEGATIVE_TTL)
+
+
+def test_cache_skips_errors_and_uncached_operations():
+    cache = ResponseCache("cache.sqlite")
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("a"), response_with({"errors": [{"message": "x"}], "data": {"search": None}}))
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("b"), response_with({"data": {}}, status_code=500))
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("c"), response_with({"errors": [{"message": "x"}]}))
+    cache.put(URL, "RefreshAssets", page_param("a"), page_response())
+    assert cache.connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+
+def test_cache_evicts_least_recently_used_responses():
+    metrics.reset()
+    size = len(page_response(10).content)
+    cache = ResponseCache("cache.sqlite", max_bytes=size * 2)
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("a"), page_response(10))
+    time.sleep(0.01)
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("b"), page_response(10))
+    time.sleep(0.01)
+    # "a" was used last, so "b" is evicted
+    cache.get(URL, "AssetSearchListCheckQuery", page_param("a"))
+    time.sleep(0.01)
+    cache.put(URL, "AssetSearchListCheckQuery", page_param("c"), page_response(10))
+    assert cache.get(URL, "AssetSearchListCheckQuery", page_param("a")) is not None
+    assert cache.get(URL, "AssetSearchListCheckQuery", page_param("b")) is None
+    assert cache.get(URL, "AssetSearchListCheckQuery", page_param("c")) is not None
+    assert metrics.snapshot()["counters"]["response_cache_evictions"] == 1
+
+
+def cached_client(url):
+    return GraphQLClient(RateLimiter(delay=0.001, max_retries=0, max_rate=10000), url=url, cache=ResponseCache("cache.sqlite"))
+
+
+def test_second_crawl_is_served_from_cache(mock):
+    state, url = mock(300)
+    assert len(create_items_list(cached_client(url), "mock-collection", 300, 100)) == 300
+    requests_before = state.request_count
+    assert len(create_items_list(cached_client(url), "mock-collection", 300, 100)) == 300
+    assert state.request_count == requests_before
+
+
+def test_create_list_with_hash_does_not_use_cached_pages(mock):
+    state, url = mock(300)
+    args = create_argument_parser().parse_args(["-c", CONTRACT_ADDRESS, "--create-list", "-s", "QmNewHash"])
+    assert create_list(cached_client(url), args)
+    requests_before = state.request_count
+    assert create_list(cached_client(url), args)
+    # Slug and item count come from the cache, the 3 pages are asked again
+    assert state.request_count - requests_before == 3
@@ -0,0 +1,135 @@
+import os
+
+import pytest
+
+from batch_sizer import BatchSizer
+from checkpoint import CrawlCheckpoint
+from collection import create_items_list
+from conftest import CONTRACT_ADDRESS, create_test_client
+from item_list import Item, dead_letter_path, iter_dead_letter_items, save_dead_letter_items
+from mock_server import MockCollection
+from mutation import MutationCompiler
+from update import create_argument_parser, create_uri_predicate, filter_stale_items, post_refresh_batch, queue_metadata_update, update_metadata
+
+ITEMS = [Item(MockCollection().relay_id(index), str(index)) for index in range(16)]
+
+
+def parse_update_arguments(*argv):
+    return create_argument_parser().parse_args(["-c", CONTRACT_ADDRESS, "--update_metadata", "--item-retries", "0", *argv])
+
+
+def test_filter_stale_items():
+    items = [
+        Item("a1", "1", "ipfs://QmNewHash/1"),
+        Item("a2", "2", "ipfs://QmOldHash/2"),
+        Item("a3", "3"),
+        Item("a4", "4", "ipfs://QmNewHash/4.json"),
+    ]
+    stale = filter_stale_items(items, create_uri_predicate("QmNewHash"))
+    assert [item.token_id for item in stale] == ["2", "3"]
+    stale = filter_stale_items(items, create_uri_predicate(uri_pattern=r"/\d+\.json$"))
+    assert [item.token_id for item in stale] == ["1", "2", "3"]
+    # Hash and pattern both have to match
+    stale = filter_stale_items(items, create_uri_predicate("QmNewHash", r"\.json$"))
+    assert [item.token_id for item in stale] == ["1", "2", "3"]
+
+
+def test_update_metadata_only_queues_stale_items(mock):
+    state, url = mock(500)
+    checkpoint = CrawlCheckpoint(CONTRACT_ADDRESS)
+    create_items_list(create_test_client(url), "mock-collection", 500, 100, checkpoint, "check")
+    checkpoint.finalize()
+
+    total, failed = update_metadata(create_test_client(url), parse_update_arguments("-s", "QmNewHash"))
+    stale_count = 500 - len(state.collection.revealed_ids)
+    assert total == stale_count
+    assert failed == []
+    assert state.refreshed_count == stale_count
+
+
+@pytest.mark.parametrize("form", ["inline", "variables"])
+def test_bisect_isolates_bad_item(mock, form):
+    bad_item = ITEMS[11]
+    state, url = mock(bad_relay_ids=[bad_item.relay_id])
+    failed = post_refresh_batch(create_test_client(url), list(ITEMS), BatchSizer(16, adaptive=False), compiler=MutationCompiler(form))
+    assert failed == [bad_item]
+    assert state.refreshed_count == 15
+    # Halves without the bad item succeed right away: one failed request per level, plus the good halves
+    assert state.request_count == 1 + 2 * 4
+
+
+def test_batch_without_bad_item_is_sent_once(mock):
+    state, url = mock()
+    failed = post_refresh_batch(create_test_client(url), list(ITEMS), compiler=MutationCompiler())
+    assert failed == []
+    assert state.request_count == 1
+
+
+def test_failed_items_are_returned_after_retries(mock):
+    bad_items = [ITEMS[2], ITEMS[9]]
+    state, url = mock(bad_relay_ids=[item.relay_id for item in bad_items])
+    failed = queue_metadata_update(create_test_client(url), list(ITEMS), 8, retries=1)
+    assert sorted(failed, key=lambda item: int(item.token_id)) == bad_items
+    assert state.refreshed_count == 14
+
+
+def crawl_item_list(url, total_count):
+    checkpoint = CrawlCheckpoint(CONTRACT_ADDRESS)
+    create_items_list(create_test_client(url), "mock-collection", total_count, 100, checkpoint)
+    checkpoint.finalize()
+
+
+def dead_token_ids():
+    return sorted(int(item.token_id) for item in iter_dead_letter_items(CONTRACT_ADDRESS))
+
+
+def test_save_dead_letter_items_merges_by_relay_id():
+    save_dead_letter_items(CONTRACT_ADDRESS, [ITEMS[1], ITEMS[2]])
+    save_dead_letter_items(CONTRACT_ADDRESS, [ITEMS[2], ITEMS[3]])
+    assert dead_token_ids() == [1, 2, 3]
+    # Sent items are dropped unless they failed again
+    save_dead_letter_items(CONTRACT_ADDRESS, [ITEMS[3]], sent={ITEMS[1].relay_id, ITEMS[3].relay_id})
+    assert dead_token_ids() == [2, 3]
+    save_dead_letter_items(CONTRACT_ADDRESS, [], merge=False)
+    assert not os.path.exists(dead_letter_path(CONTRACT_ADDRESS))
+
+
+def test_successful_run_removes_items_from_dead_letter_file(mock):
+    state, url = mock(200)
+    crawl_item_list(url, 200)
+    state.bad_relay_ids = {ITEMS[3].relay_id}
+    update_metadata(create_test_client(url), parse_update_arguments())
+    assert dead_token_ids() == [3]
+
+    state.bad_relay_ids = set()
+    _, failed = update_metadata(create_test_client(url), parse_update_arguments())
+    assert failed == []
+    assert dead_token_ids() == []
+
+
+def test_run_keeps_dead_letter_items_it_did_not_send(mock):
+    state, url = mock(200)
+    crawl_item_list(url, 200)
+    state.bad_relay_ids = {ITEMS[3].relay_id, ITEMS[12].relay_id}
+    update_metadata(create_test_client(url), parse_update_arguments())
+
+    # Token 12 fails again, token 3 is outside --tokens
+    state.bad_relay_ids = {ITEMS[12].relay_id}
+    update_metadata(create_test_client(url), parse_update_arguments("--tokens", "10-20"))
+    assert dead_token_ids() == [3, 12]
+
+
+def test_retry_failed_only_sends_dead_letter_items(mock):
+    state, url = mock(200)
+    crawl_item_list(url, 200)
+    state.bad_relay_ids = {ITEMS[3].relay_id, ITEMS[7].relay_id, ITEMS[12].relay_id}
+    update_metadata(create_test_client(url), parse_update_arguments())
+
+    state.bad_relay_ids = {ITEMS[7].relay_id}
+    refreshed_before = state.refreshed_count
+    total, failed = update_metadata(create_test_client(url), parse_update_arguments("--retry-failed", "--tokens", "0-10"))
+    assert total == 2
+    assert [item.token_id for item in failed] == ["7"]
+    assert state.refreshed_count - refreshed_before == 1
+    # Token 12 is kept for a later '--retry-failed' outside the range
+    assert dead_token_ids() == [7, 12]
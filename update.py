@@ -1,272 +1,298 @@
 import argparse
-import json
 import logging
-import itertools
-import requests
+import os
+import re
 import time
+import itertools
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from batch_sizer import BatchSizer
+from checkpoint import CrawlCheckpoint
+from client import add_client_arguments, create_client
+from collection import get_collection_detail, create_items_list, create_items_list_bidirectional, crawl_concurrency
+from item_list import iter_update_items, count_update_items, dead_letter_path, iter_dead_letter_items, save_dead_letter_items
+from item_store import ItemStore, in_token_ranges, item_store_path, parse_token_ranges
+from metrics import metrics, start_metrics, finish_metrics
+from mutation import MutationCompiler, add_mutation_arguments, create_compiler
+from rate_limiter import RateLimitExceeded, classify_response
 
 logger = logging.getLogger(__name__)
 
-# Process items in chunks
-def chunks(iterable, size):
-    it = iter(iterable)
-    while True:
-        chunk = tuple(itertools.islice(it, size))
-        if not chunk:
-            break
-        yield chunk
-
-
-# Save update list
-def save_update_items(contract_address, items):
-    with open(f'update_lists/{contract_address}_item_list.json', 'w') as file:
-        json.dump(items, file)
-
-
-# Load update list
-def load_update_items(contract_address):
-    with open(f'update_lists/{contract_address}_item_list.json', 'r') as file:
-        items = json.load(file)
-    return sorted(items,key=lambda x: x["node"]["asset"]["tokenId"])
-
-# load query from file
-def load_gql_query(file_name):
-    with open(f'query/{file_name}', 'r') as file:
-        query = file.read()
-    return query
-
+# Arguments of update.py. Also used by orchestrate.py
+def create_argument_parser(contract_required=True):
+    parser = argparse.ArgumentParser(description='Usage example: python update.py --create-list --update_metadata -c "0x6c94954d0b265f657a4a1b35dfaa8b73d1a3f199"')
+    parser.add_argument('--create-list',action='store_true',help='This creates a json lines file with necessary data (metadata & item ID) to request updates on metadata in Opensea. This should only used once per contract. Use "--delta" when new NFTs are minted. Requires: "--contract_address".')
+    parser.add_argument('--update_metadata',action='store_true',help='POST metadata update queue to Opensea. Requires: "--contract_address".')
+    parser.add_argument('--resume',action='store_true',help="(optional) Continue interrupted '--create-list' from the last saved page.")
+    parser.add_argument('--delta',action='store_true',help="(optional) Only query items created after the saved item list on '--create-list' and add them to it. Use this when new NFTs are minted.")
+    parser.add_argument('--bidirectional',action='store_true',help="(optional) Query items from both ends of the collection at once on '--create-list'. Can't be used with '--resume' or '--delta'.")
+    parser.add_argument('--query',choices=['update','check'],default='update',help="(optional) Fields to query on '--create-list'. \"update\" only queries item IDs, \"check\" adds metadata URI. Default is update.")
+    parser.add_argument('--retry-failed',action='store_true',help="(optional) Queue update only for items that failed in earlier '--update_metadata' runs (saved in the dead letter file).")
+    parser.add_argument('--item-retries',type=int,default=3,help="(optional) Number of times failed items are retried at the end of '--update_metadata' before they are saved to the dead letter file. Default is 3.")
+    parser.add_argument('-c','--contract-address',required=contract_required,type=str,help='Contract address of NFT collection.')
+    parser.add_argument('-b','--batch_size',type=int,default=1000,help="(optional) Maximum number of Queues to batch in one request on '--update_metadata'. Batch size is lowered automatically when requests are slow or fail. Default is 1000.")
+    parser.add_argument('--fixed-batch-size',action='store_true',help="(optional) Always send '--batch_size' Queues in one request.")
+    parser.add_argument('--target-latency',type=float,default=10,help="(optional) Seconds a mutation request should take. Batch size is lowered when requests are slower. Default is 10.")
+    parser.add_argument('-j','--concurrency',type=int,default=1,help="(optional) Number of mutation batches kept in flight at once on '--update_metadata'. Default is 1.")
+    parser.add_argument('-s','--hash',type=str,help="(optional) Only queue update for items whose metadata URI doesn't contain this hash yet. Combine with '--create-list' to check freshly queried metadata URIs.")
+    parser.add_argument('--uri-pattern',type=str,help="(optional) Only queue update for items whose metadata URI doesn't match this regular expression yet.")
+    parser.add_argument('--tokens',type=parse_token_ranges,help="(optional) Only queue update for these token ids, e.g. \"500-620,900\". Read from the SQLite item store if there is one.")
+    parser.add_argument('--store',action='store_true',help="(optional) Also save items to a SQLite item store (indexed by token id) on '--create-list', so '--tokens' doesn't read the whole item list.")
+    add_mutation_arguments(parser)
+    add_client_arguments(parser, cool_down=3, delay=1)
+    return parser
 
 # Parse args
 def get_script_arguments():
-    parser = argparse.ArgumentParser(description='Usage example: python update.py --create-list --update_metadata -c "0x6c94954d0b265f657a4a1b35dfaa8b73d1a3f199"')
-    parser.add_argument('--create-list',action='store_true',help='This creates a json file with necessary data (metadata & item ID) to request updates on metadata in Opensea. This should only used once per contract unless new NFTs are minted. Requires: "--contract_address".')
-    parser.add_argument('--update_metadata',action='store_true',help='POST metadata update queue to Opensea. Requires: "--contract_address".')
-    parser.add_argument('-c','--contract-address',required=True,type=str,help='Contract address of NFT collection.')
-    parser.add_argument('-b','--batch_size',type=int,default=1000,help="(optional) Number of Queues to batch in one request on '--update_metadata'. Default is 1000.")
-    # parser.add_argument('--cool-down',type=int,help='(optional) Seconds to wait when API rate limit is reached.')
-    # parser.add_argument('--delay',type=int,help='(optional) Interval of each API call.')
+    parser = create_argument_parser()
     args = parser.parse_args()
+    if args.bidirectional and (args.resume or args.delta):
+        parser.error("--bidirectional can't be used with --resume or --delta")
     logger.info(args)
     return args
 
-# Query collectionSlug and total number of items from Contract address
-def get_collection_detail(contract_address, cool_down=0.2):
-    url = "https://api.opensea.io/graphql/"
-    # bypass cloudflare
-    header={
-        "Content-Type": "application/json",
-        "User-Agent": "PostmanRuntime/7.26.8"
-    }
-    # Graphql Query: Get collectionSlug
-    slug_query = load_gql_query("slug_query.graphql")
-    slug_variables = {
-        "query": f"{contract_address}"
-    }
-    slug_param = {'query': slug_query, 'variables': slug_variables}
-    # Make http POST
-    slug_response = requests.post(url, json=slug_param, headers=header)
-    if slug_response.status_code != 200:
-        logger.warning(slug_response.text)
-        logger.warning("Terminating Process: Check contract address")
-        return ((),)
-    
-    try:
-        slug_data = slug_response.json()
-        slug_result = slug_data["data"]["collections"]["edges"][0]
-        collection_slug = slug_result["node"]["slug"]
-    except:
-        logger.warning("Terminating Process: No CollectionSlug Found")
-        return((),)
-    
-    logger.info(f"Found Collection: {collection_slug}")
-    
-    # wait for rate limit cooldown
-    time.sleep(cool_down)
-
-    # Graphql Query: Get number of items in collection
-    count_query = load_gql_query("collection_item_count_query.graphql")
-    count_variables = {
-        "collections": [f"{collection_slug}"]
-    }
-    count_param = {'query': count_query, 'variables': count_variables}
-    # Make http POST
-    count_response = requests.post(url, json=count_param, headers=header)
-    if count_response.status_code != 200:
-        logger.warning(count_response.text)
-        logger.warning("Terminating Process: POST Request Error")
-        return ((),)
+# Create check for updated metadata URI from hash and/or regular expression
+def create_uri_predicate(new_hash=None, uri_pattern=None):
+    pattern = re.compile(uri_pattern) if uri_pattern else None
+    def is_updated(uri):
+        if new_hash and new_hash not in uri:
+            return False
+        if pattern and not pattern.search(uri):
+            return False
+        return True
+    return is_updated
+
+# Items that still need metadata update. Items without saved metadata URI are always included
+def filter_stale_items(items, is_updated):
+    for item in items:
+        if item.token_metadata is None or not is_updated(item.token_metadata):
+            yield item
+
+# Pass items through and add their relayId to sent
+def track_sent_items(items, sent):
+    for item in items:
+        sent.add(item.relay_id)
+        yield item
+
+# Failures caused by the batch itself (bad alias, too large, timeout) are worth bisecting.
+# Rate limit and Cloudflare blocks fail every batch the same way, so splitting would only multiply requests.
+def _is_batch_specific_failure(error):
+    if error.response is None:
+        return True
+    return classify_response(error.response) in ("client_error", "server_error")
+
+# POST one mutation batch and return items that failed to queue.
+# Failed batches are split in half and retried so only the offending aliases fail.
+def post_refresh_batch(client, item_chunk, sizer=None, bisected=False, compiler=None):
+    mutation = (compiler or MutationCompiler()).compile(item_chunk)
+    param = mutation.to_param()
 
+    # Make http POST
+    start = time.monotonic()
     try:
-        count_data = count_response.json()
-        count_result = count_data["data"]["search"]["totalCount"]
-    except:
-        logger.warning("Terminating Process: No totalCount Found")
-        return((),)
-    
-    logger.info(f"Total items in Collection: {count_result}")
-    
-    return (collection_slug, count_result)
-    
-# This will create update list of collection which includes data needed to queue metadata update
-def create_items_list(collection_slug, total_count, limit, cool_down=0.2, delay=1):
-    complete_items = []
-    total_null_count = 0
-    url = "https://api.opensea.io/graphql/"
-    next_curser = ""
-    has_next_page = True
-
-    # bypass cloudflare
-    header={
-        "Content-Type": "application/json",
-        "User-Agent": "PostmanRuntime/7.26.8"
-    }
-
-    while has_next_page:
-        time.sleep(delay)
-
-        query = load_gql_query("asset_search_list_pagination_query.graphql")
-
-        variables = {
-        "collections": [
-            f"{collection_slug}"
-        ],
-        "count": limit,
-        "cursor": f"{next_curser}"
-        }
-        param = {'query': query, 'variables': variables}
-
-        # Flag for http request result
-        success = False
-
-        while not success:
-            # Make http POST
-            response = requests.post(url, json=param, headers=header)
-            # Check for HTTP error
-            if response.status_code != 200:
-                logger.warning(response.text)
-
-                # Rate Limit Cooldown Counter
-                for _ in range(cool_down, 0, -1):
-                    time.sleep(1)
-            
-            # Request Success: Escape HTTP request loop
-            else:
-                success = True
-            
-        try:
-            data = response.json()
-            search_result = data["data"]["search"]
-            items = search_result["edges"]
-            # Remove null assets
-            filtered_items = list(filter(lambda x: x["node"]["asset"] != None, items))
-            # Log number of null assets
-            if len(filtered_items) < len(items):
-                null_count = len(items)-len(filtered_items)
-                total_null_count += null_count
-                logger.warning(f"Found {null_count} null Asset.")
-
-            complete_items.extend(filtered_items)
-            # Check if next page is available
-            has_next_page = search_result["pageInfo"]["hasNextPage"]
-            if has_next_page:
-                next_curser = search_result["pageInfo"]["endCursor"]
-        
-        except:
-            logger.warning(f"{response.text}")
-            logger.warning("Error Ignored")
-            has_next_page = False
-
-        logger.info(f"{len(complete_items)}/{total_count} items completed")
-    
-    logger.info(f"{total_null_count} items returned 'null'")
-
-    return complete_items
+        response = client.post(param)
+        latency = time.monotonic() - start
+        results = response.json()["data"]
+        if not results:
+            raise ValueError(f"No data in response: {response.text[:500]}")
+    except RateLimitExceeded as e:
+        # Halves of a failed batch don't lower batch size again
+        if sizer and not bisected:
+            sizer.record_failure(len(item_chunk))
+        if len(item_chunk) > 1 and _is_batch_specific_failure(e):
+            return _bisect_refresh_batch(client, item_chunk, sizer, compiler)
+        logger.warning(f"Giving up on batch of {len(item_chunk)} items")
+        return list(item_chunk)
+    except Exception as e:
+        # Not json or GraphQL error without data
+        metrics.increment("parse_failures")
+        logger.warning(f"Failed to parse queue result json: {e}")
+        if sizer and not bisected:
+            sizer.record_failure(len(item_chunk))
+        if len(item_chunk) > 1:
+            return _bisect_refresh_batch(client, item_chunk, sizer, compiler)
+        logger.warning(f"Failed to queue item with token id: {item_chunk[0].token_id}")
+        return list(item_chunk)
+
+    if sizer:
+        sizer.record_success(len(item_chunk), latency, mutation.payload_size())
+
+    failed_items = []
+
+    # Check for unsuccessful update. Aliases missing from the response also count as failed
+    for item, alias in zip(item_chunk, mutation.aliases):
+        result = results.get(alias) if alias else None
+        if not result or result.get("refresh") != True:
+            logger.warning(f"Failed to queue item with token id: {item.token_id}")
+            failed_items.append(item)
+
+    return failed_items
+
+def _bisect_refresh_batch(client, item_chunk, sizer, compiler):
+    middle = len(item_chunk) // 2
+    logger.warning(f"Batch of {len(item_chunk)} items failed: Retrying as {middle} + {len(item_chunk)-middle} items")
+    return post_refresh_batch(client, item_chunk[:middle], sizer, True, compiler) + post_refresh_batch(client, item_chunk[middle:], sizer, True, compiler)
+
+# Send items in batches and yield (batch, failed items) as each batch completes
+def _dispatch_batches(client, items, sizer, concurrency, compiler=None):
+    items = iter(items)
+    next_batch = lambda: tuple(itertools.islice(items, sizer.size))
+
+    if concurrency <= 1:
+        # Batch items to send in one request
+        for item_chunk in iter(next_batch, ()):
+            yield item_chunk, post_refresh_batch(client, item_chunk, sizer, compiler=compiler)
+        return
+
+    logger.info(f"Dispatching with {concurrency} batches in flight")
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+        # Keep at most `concurrency` batches in flight so chunks are built lazily
+        for _ in range(concurrency):
+            item_chunk = next_batch()
+            if not item_chunk:
+                break
+            future = executor.submit(post_refresh_batch, client, item_chunk, sizer, False, compiler)
+            in_flight[future] = item_chunk
+
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                item_chunk = in_flight.pop(future)
+                try:
+                    failed_items = future.result()
+                except Exception as e:
+                    logger.warning(f"Batch of {len(item_chunk)} items failed: {e}")
+                    failed_items = list(item_chunk)
+                yield item_chunk, failed_items
+
+                next_chunk = next_batch()
+                if next_chunk:
+                    future = executor.submit(post_refresh_batch, client, next_chunk, sizer, False, compiler)
+                    in_flight[future] = next_chunk
 
 # This will queue metadata update to Opensea
-def queue_metadata_update(items, batch_size, cool_down=3, delay=3):
-    url = "https://api.opensea.io/graphql/"
-    # bypass cloudflare
-    header={
-        "Content-Type": "application/json",
-        "User-Agent": "PostmanRuntime/7.26.8"
-    }
-
+# items can be a generator: batches are built lazily while earlier batches are being sent.
+# batch_size is either fixed number of items per request or BatchSizer tuning it while running.
+# Failed items are re-batched at the end up to `retries` times with backoff. Returns items that still failed.
+# compiler (MutationCompiler) picks inline or variables form and the compiled mutation cache.
+# collection (contract address) labels refresh progress in metrics when several collections are processed at once.
+def queue_metadata_update(client, items, batch_size, concurrency=1, total=None, retries=3, compiler=None, collection=None):
+    if total is None:
+        total = len(items)
+    sizer = batch_size if isinstance(batch_size, BatchSizer) else BatchSizer(batch_size, adaptive=False)
+    compiler = compiler or MutationCompiler()
     total_update_count = 0
-    total_fail_count = 0
-    # Batch items to send in one request
-    for item_chunk in chunks(items, batch_size):
-
-        query_string = ""
-        # Create query detail
-        for item in item_chunk:
-            try:
-                item_id = item["node"]["asset"]["relayId"]
-                alias = "_" + str(item["node"]["asset"]["tokenId"])
-            except:
-                logger.warning(f'Item ID not Found for: {item["node"]["asset"]["name"]})')
-                
-            query_string += f'{alias}: assets {{refresh(asset: "{item_id}")}}'
-
-        query = f'mutation {{{query_string}}}'
-        param = {'query': query}
-
-        # Flag for http request result
-        success = False
-
-        while not success:
-            # Make http POST
-            response = requests.post(url, json=param, headers=header)
-            # Check for HTTP error
-            if response.status_code != 200:
-                logger.warning(f"Response HTML:\n{response.text}")
-                logger.info(f"Retrying request in {cool_down} second(s).")
-
-                # Rate Limit Cooldown Counter
-                for _ in range(cool_down, 0, -1):
-                    time.sleep(1)
-
-            # Request Success: Escape HTTP request loop
-            else:
-                success = True
-        
-        fail_count = 0
-
-        # Parse response to check for unsuccessful update
-        try:
-            data = response.json()
-            results = data["data"]
-            for result_alias in results:
-                status = results[result_alias]["refresh"]
-                if status != True:
-                    logger.warning(f"Failed to queue item with token id: {result_alias[1:]}")
-                    fail_count += 1
-        except:
-            logger.warning("Failed to parse queue result json")
-
-        time.sleep(delay)
+    failed = []
+    metrics.start_phase("refresh", total, collection=collection)
+
+    for item_chunk, failed_items in _dispatch_batches(client, items, sizer, concurrency, compiler):
         # Show progress
-        total_update_count += len(item_chunk)-fail_count
-        logger.info(f"Queued Update: {total_update_count}/{len(items)}")
-    
-    logger.info(f"Successfully Queued {len(items)-total_fail_count}/{len(items)}")
+        total_update_count += len(item_chunk)-len(failed_items)
+        failed.extend(failed_items)
+        metrics.set_progress("refresh", total_update_count, collection=collection)
+        logger.info(f"Queued Update: {total_update_count}/{total}")
 
+    for attempt in range(1, retries+1):
+        if not failed:
+            break
+        wait_seconds = client.limiter.cool_down * 2 ** (attempt-1)
+        logger.info(f"Retrying {len(failed)} failed items in {wait_seconds} second(s) ({attempt}/{retries})")
+        client.limiter.sleep(wait_seconds)
+        retry_items, failed = failed, []
+        for item_chunk, failed_items in _dispatch_batches(client, retry_items, sizer, concurrency, compiler):
+            total_update_count += len(item_chunk)-len(failed_items)
+            failed.extend(failed_items)
+            metrics.set_progress("refresh", total_update_count, collection=collection)
+            logger.info(f"Queued Update: {total_update_count}/{total}")
+
+    metrics.increment("refresh_failed_items", len(failed))
+    logger.info(f"Successfully Queued {total-len(failed)}/{total}")
+    return failed
+
+
+
+# Query items of collection and save item list. Returns False if the crawl did not complete
+def create_list(client, args):
+    collection_detail = get_collection_detail(client, args.contract_address)
+    if len(collection_detail) != 2:
+        return False
+    (collection_slug, total_count) = collection_detail
+    checkpoint = CrawlCheckpoint(args.contract_address, args.resume, args.delta)
+    # Metadata URI is needed to find items that still need update
+    query = "check" if (args.hash or args.uri_pattern) and args.query == "update" else args.query
+    if client.cache and (args.hash or args.uri_pattern):
+        # Cached pages hold metadata URIs as they were when saved, so they would hide items updated since
+        logger.info("Not using cached item pages: '-s' and '--uri-pattern' need current metadata URIs")
+        client.cache.search_ttl = 0
+    crawl = create_items_list_bidirectional if args.bidirectional else create_items_list
+    crawl(client, collection_slug, total_count, 100, checkpoint, query, args.contract_address) #limit locked to 100. 100 max.
+    if not checkpoint.finished:
+        if not args.bidirectional:
+            logger.warning("Crawl interrupted: Run again with '--resume' to continue from the last saved page")
+        return False
+    checkpoint.finalize(store=args.store)
+    logger.info(f"Successfully Created and Saved {collection_slug}'s Items List")
+    return True
+
+# Load items to update: dead letter file, token id ranges or the whole item list.
+# Returns function creating a fresh iterator (items are read twice when filtering by URI) and number of items
+def select_items(args):
+    if args.retry_failed:
+        items = list(iter_dead_letter_items(args.contract_address))
+        if args.tokens:
+            items = [item for item in items if in_token_ranges(item.token_id, args.tokens)]
+        logger.info(f"Retrying {len(items)} items from dead letter file")
+        return lambda: iter(items), len(items)
+    if args.tokens:
+        if os.path.exists(item_store_path(args.contract_address)):
+            store = ItemStore(args.contract_address)
+            total = store.count_token_ranges(args.tokens)
+            logger.info(f"Found {total} items in token range from item store")
+            return lambda: store.iter_token_ranges(args.tokens), total
+        logger.warning("No item store: Reading whole item list. Run 'python item_store.py' or '--create-list --store' to create it")
+        items = [item for item in iter_update_items(args.contract_address) if in_token_ranges(item.token_id, args.tokens)]
+        return lambda: iter(items), len(items)
+    return lambda: iter_update_items(args.contract_address), count_update_items(args.contract_address)
+
+# Queue metadata update for saved item list. Returns (number of items, items that failed)
+def update_metadata(client, args):
+    load_items, total = select_items(args)
+    items = load_items()
+    if args.hash or args.uri_pattern:
+        is_updated = create_uri_predicate(args.hash, args.uri_pattern)
+        stale_count = sum(1 for _ in filter_stale_items(load_items(), is_updated))
+        logger.info(f"{total-stale_count}/{total} items already have new metadata URI")
+        items = filter_stale_items(items, is_updated)
+        total = stale_count
+    # Items sent in this run are dropped from the dead letter file unless they fail again
+    sent = set()
+    if os.path.exists(dead_letter_path(args.contract_address)):
+        items = track_sent_items(items, sent)
+    sizer = BatchSizer(args.batch_size, target_latency=args.target_latency, adaptive=not args.fixed_batch_size)
+    failed = queue_metadata_update(client, items, sizer, concurrency=args.concurrency, total=total, retries=args.item_retries, compiler=create_compiler(args), collection=args.contract_address)
+    save_dead_letter_items(args.contract_address, failed, sent=sent)
+    if failed:
+        logger.warning(f"{len(failed)} items failed: Run again with '--update_metadata --retry-failed' to retry them")
+    return total, failed
 
 
 def main():
     logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Initialize] - %(levelname)s - %(message)s', level=logging.INFO)
     args = get_script_arguments()
+    client = create_client(args, max(args.concurrency, crawl_concurrency(args.bidirectional)))
+    start_metrics(args)
 
-    if args.create_list:
-        logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Create List] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
-        (collection_slug, total_count) = get_collection_detail(args.contract_address)
-        items = create_items_list(collection_slug, total_count, 100) #limit locked to 100. 100 max.
-        save_update_items(args.contract_address,items)
-        logger.info(f"Successfully Created and Saved {collection_slug}'s Items List")
-    
-    if args.update_metadata:
-        logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Post Update] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
-        items = load_update_items(args.contract_address)
-        queue_metadata_update(items, args.batch_size)
+    try:
+        if args.create_list:
+            logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Create List] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
+            if not create_list(client, args):
+                return
+
+        if args.update_metadata:
+            logging.basicConfig(format='%(asctime)s - Opensea Meta Updater - [Post Update] - %(levelname)s - %(message)s', level=logging.INFO,force=True)
+            update_metadata(client, args)
+    finally:
+        finish_metrics(args)
 
 
 if __name__ == '__main__':